@@ -0,0 +1,89 @@
+"""
+Compare building the metadata DataFrame with per-record ``pd.json_normalize`` +
+``pd.concat`` against the columnar ``RecordTable``.
+
+Run from the repository root:
+
+    python dump/benchmarks/bench_record_table.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import pandas as pd
+
+from parser import RecordStreamParser
+from rename import SOURCE_COLUMNS
+from table import RecordTable
+
+
+def make_document(n_records: int) -> bytes:
+    """Build a synthetic EFetch document resembling SRA experiment packages."""
+    packages = []
+    for uid in range(n_records):
+        attributes = "".join(
+            f"<SAMPLE_ATTRIBUTE><TAG>tag{i}</TAG><VALUE>value{i}</VALUE></SAMPLE_ATTRIBUTE>"
+            for i in range(uid % 7 + 2)
+        )
+        files = "".join(
+            f'<SRAFile filename="SRR{uid}_{i}" url="https://example.org/SRR{uid}_{i}" size="{i}">'
+            f'<Alternatives url="https://mirror.example.org/SRR{uid}_{i}" org="NCBI"/></SRAFile>'
+            for i in range(2)
+        )
+        packages.append(
+            f'<EXPERIMENT_PACKAGE>'
+            f'<EXPERIMENT accession="SRX{uid}" alias="exp{uid}"><IDENTIFIERS><PRIMARY_ID>SRX{uid}</PRIMARY_ID></IDENTIFIERS>'
+            f'<TITLE>Experiment {uid}</TITLE><DESIGN><LIBRARY_DESCRIPTOR><LIBRARY_NAME>lib{uid}</LIBRARY_NAME>'
+            f'<LIBRARY_STRATEGY>RNA-Seq</LIBRARY_STRATEGY><LIBRARY_SOURCE>TRANSCRIPTOMIC</LIBRARY_SOURCE>'
+            f'<LIBRARY_SELECTION>cDNA</LIBRARY_SELECTION><LIBRARY_LAYOUT><PAIRED/></LIBRARY_LAYOUT>'
+            f'</LIBRARY_DESCRIPTOR></DESIGN></EXPERIMENT>'
+            f'<STUDY accession="SRP{uid % 10}"><IDENTIFIERS><EXTERNAL_ID namespace="BioProject">PRJNA{uid}</EXTERNAL_ID>'
+            f'</IDENTIFIERS><DESCRIPTOR><STUDY_TITLE>Study</STUDY_TITLE><STUDY_ABSTRACT>Abstract</STUDY_ABSTRACT>'
+            f'</DESCRIPTOR></STUDY>'
+            f'<SAMPLE accession="SRS{uid}" alias="sample{uid}"><SAMPLE_NAME><TAXON_ID>9606</TAXON_ID>'
+            f'<SCIENTIFIC_NAME>Homo sapiens</SCIENTIFIC_NAME></SAMPLE_NAME><SAMPLE_ATTRIBUTES>{attributes}'
+            f'</SAMPLE_ATTRIBUTES></SAMPLE>'
+            f'<RUN_SET><RUN accession="SRR{uid}" total_spots="{uid * 10}" total_bases="{uid * 1000}" size="{uid}">'
+            f'<SRAFiles>{files}</SRAFiles></RUN></RUN_SET>'
+            f'</EXPERIMENT_PACKAGE>'
+        )
+    return f"<EXPERIMENT_PACKAGE_SET>{''.join(packages)}</EXPERIMENT_PACKAGE_SET>".encode()
+
+
+def parse(document: bytes):
+    parser = RecordStreamParser()
+    return parser.feed(document) + parser.close()
+
+
+def build_concat(records):
+    return pd.concat([pd.json_normalize(record) for record in records])
+
+
+def build_table(records, columns=None):
+    table = RecordTable(columns)
+    table.extend(records)
+    return table.to_frame()
+
+
+def main():
+    print(f"{'records':>8} {'concat':>10} {'table':>10} {'projected':>10} {'speedup':>8}")
+    for n_records in (100, 500, 1000):
+        records = parse(make_document(n_records))
+        repeat = max(1, 2000 // n_records)
+
+        concat = timeit.timeit(lambda: build_concat(records), number=repeat) / repeat
+        table = timeit.timeit(lambda: build_table(records), number=repeat) / repeat
+        projected = timeit.timeit(
+            lambda: build_table(records, SOURCE_COLUMNS), number=repeat
+        ) / repeat
+
+        print(
+            f"{n_records:>8} {concat * 1000:>8.1f}ms {table * 1000:>8.1f}ms "
+            f"{projected * 1000:>8.1f}ms {concat / table:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+# SQLite limits the number of bound parameters per statement
+_BATCH = 500
+# Seconds between writes of buffered counters and access times, and between
+# evictions of expired and least recently used records
+_FLUSH_INTERVAL = 10.0
+_EVICT_INTERVAL = 60.0
+
+
+def projection_key(fields: Optional[Iterable[str]]) -> str:
+    """Identify the set of extracted fields a cached record was built with."""
+    if fields is None:
+        return "*"
+    return hashlib.sha1("\n".join(sorted(set(fields))).encode()).hexdigest()
+
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS records (
+        uid INTEGER NOT NULL,
+        projection TEXT NOT NULL,
+        record TEXT NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL,
+        PRIMARY KEY (uid, projection)
+    );
+    CREATE INDEX IF NOT EXISTS records_accessed ON records (accessed);
+    CREATE TABLE IF NOT EXISTS searches (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0);
+"""
+
+
+class _SqliteStore:
+    """
+    Lazily opened SQLite database, with one connection per process.
+
+    The connection may be used from any thread while holding ``lock``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked workers
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+
+class MetadataCache(_SqliteStore):
+    """
+    On-disk cache of parsed records keyed by SRA UID.
+
+    Records are stored as JSON in a SQLite database shared by all workers.
+    Entries expire after ``ttl`` seconds, and once the cache holds more than
+    ``max_entries`` records the least recently used ones are evicted. Hit and
+    miss counters are kept in the database as well.
+
+    Methods block on the database and are meant to run in a thread pool.
+    Counters and access times are buffered and written at most every
+    ``_FLUSH_INTERVAL`` seconds, and eviction runs at most every
+    ``_EVICT_INTERVAL`` seconds, so reads do not open write transactions.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+        self._accessed: Dict[Tuple[int, str], float] = {}
+        self._flushed = time.time()
+        self._evicted = 0.0
+
+    def get_many(self, uids: List[int], projection: str) -> Dict[int, Dict[str, Any]]:
+        """Return the fresh cached records among ``uids``."""
+        now = time.time()
+        found = {}
+        with self.lock:
+            for i in range(0, len(uids), _BATCH):
+                batch = uids[i:i + _BATCH]
+                rows = self.connection.execute(
+                    f"SELECT uid, record FROM records "
+                    f"WHERE projection = ? AND created > ? AND uid IN ({','.join('?' * len(batch))})",
+                    [projection, now - self.ttl, *batch]
+                )
+                found.update((uid, json.loads(record)) for uid, record in rows)
+
+            self._accessed.update(((uid, projection), now) for uid in found)
+            self._hits += len(found)
+            self._misses += len(uids) - len(found)
+            if now - self._flushed >= _FLUSH_INTERVAL:
+                with self.connection:
+                    self._flush(now)
+
+        return found
+
+    def put_many(self, records: Dict[int, Dict[str, Any]], projection: str):
+        """Store records, periodically evicting expired and least recently used entries."""
+        if not records:
+            return
+
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                [
+                    (uid, projection, json.dumps(record), now, now)
+                    for uid, record in records.items()
+                ]
+            )
+            self._flush(now)
+
+            if now - self._evicted >= _EVICT_INTERVAL:
+                self._evicted = now
+                self._evict(now)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters (shared by all workers) and the number of cached records."""
+        with self.lock:
+            with self.connection:
+                self._flush(time.time())
+            stats = dict(self.connection.execute("SELECT name, value FROM stats"))
+            (stats["entries"],), = self.connection.execute("SELECT COUNT(*) FROM records")
+        return stats
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None and self._pid == os.getpid():
+                with self.connection:
+                    self._flush(time.time())
+            super().close()
+
+    def _flush(self, now: float):
+        # Called inside a transaction
+        self._flushed = now
+        if self._accessed:
+            self.connection.executemany(
+                "UPDATE records SET accessed = ? WHERE uid = ? AND projection = ?",
+                [(accessed, uid, projection) for (uid, projection), accessed in self._accessed.items()]
+            )
+            self._accessed.clear()
+        if self._hits or self._misses:
+            self.connection.executemany(
+                "UPDATE stats SET value = value + ? WHERE name = ?",
+                [(self._hits, "hits"), (self._misses, "misses")]
+            )
+            self._hits = self._misses = 0
+
+    def _evict(self, now: float):
+        self.connection.execute("DELETE FROM records WHERE created <= ?", [now - self.ttl])
+
+        (count,), = self.connection.execute("SELECT COUNT(*) FROM records")
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM records WHERE rowid IN "
+                "(SELECT rowid FROM records ORDER BY accessed LIMIT ?)",
+                [count - self.max_entries]
+            )
+
+
+class TTLCache:
+    """
+    In-memory cache whose entries expire after ``ttl`` seconds, evicted LRU first.
+
+    ``get`` and ``set`` are coroutines so the cache can be swapped for
+    :class:`SharedTTLCache`, which goes to the database.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        return self._lookup(key)
+
+    async def set(self, key: Hashable, value: Any):
+        self._store(key, value, time.time() + self.ttl)
+
+    def close(self):
+        pass
+
+    def _lookup(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key: Hashable, value: Any, expires: float):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SharedTTLCache(TTLCache):
+    """
+    TTLCache backed by the SQLite database, so entries are shared by all workers.
+
+    Keys must be JSON serializable, and values are returned as decoded JSON.
+    Entries found in memory are returned without touching the database;
+    database work runs in the thread pool, and expired entries are deleted
+    at most every ``_EVICT_INTERVAL`` seconds.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        super().__init__(ttl, max_entries)
+        self._database = _SqliteStore(path)
+        self._evicted = 0.0
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        value = self._lookup(key)
+        if value is not None:
+            return value
+
+        row = await run_in_threadpool(self._select, json.dumps(key))
+        if row is None:
+            return None
+
+        value = json.loads(row[0])
+        self._store(key, value, row[1])
+        return value
+
+    async def set(self, key: Hashable, value: Any):
+        expires = time.time() + self.ttl
+        self._store(key, value, expires)
+        await run_in_threadpool(self._insert, json.dumps(key), json.dumps(value), expires)
+
+    def close(self):
+        self._database.close()
+
+    def _select(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._database.lock:
+            return self._database.connection.execute(
+                "SELECT value, expires FROM searches WHERE key = ? AND expires > ?",
+                [key, time.time()]
+            ).fetchone()
+
+    def _insert(self, key: str, value: str, expires: float):
+        now = time.time()
+        with self._database.lock, self._database.connection as connection:
+            connection.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?)", [key, value, expires])
+            if now - self._evicted >= _EVICT_INTERVAL:
+                self._evicted = now
+                connection.execute("DELETE FROM searches WHERE expires <= ?", [now])
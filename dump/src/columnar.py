@@ -0,0 +1,81 @@
+import importlib.util
+import io
+import json
+import math
+from typing import Optional
+
+import pandas as pd
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+COLUMNAR_MEDIA_TYPES = (ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE)
+
+
+def pyarrow_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def negotiate_media_type(accept: Optional[str]) -> Optional[str]:
+    """Return the columnar media type requested in an ``Accept`` header, if any."""
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in COLUMNAR_MEDIA_TYPES:
+            return media_type
+    return None
+
+
+def _json_default(value):
+    return str(value)
+
+
+def _to_text(value) -> Optional[str]:
+    """Render a value of a mixed column: strings as they are, nested values as JSON."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_json_default)
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value)
+
+
+def to_arrow_table(df: pd.DataFrame):
+    """
+    Convert a renamed metadata DataFrame into a ``pyarrow.Table``.
+
+    Columns keep their pandas types. Columns Arrow cannot infer a single type
+    for (e.g. dicts with varying keys from extra fields, or a title that is a
+    string in most records and a dict with ``#text`` in others) are stored as
+    strings: nested values as JSON, strings unchanged.
+    """
+    import pyarrow as pa
+
+    arrays = []
+    for name in df.columns:
+        column = df[name]
+        try:
+            array = pa.array(column, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            array = pa.array([_to_text(value) for value in column], type=pa.string())
+        arrays.append(array)
+
+    return pa.Table.from_arrays(arrays, names=[str(name) for name in df.columns])
+
+
+def to_columnar(df: pd.DataFrame, media_type: str) -> bytes:
+    """Serialize a DataFrame as an Arrow IPC stream or a Parquet file."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = to_arrow_table(df)
+    sink = io.BytesIO()
+
+    if media_type == ARROW_MEDIA_TYPE:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif media_type == PARQUET_MEDIA_TYPE:
+        pq.write_table(table, sink)
+    else:
+        raise ValueError(f"Unsupported media type: {media_type}")
+
+    return sink.getvalue()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+# EFetch batching
+EFETCH_CHUNK_SIZE = _env_int("EZMETA_EFETCH_CHUNK_SIZE", 200)
+EFETCH_MAX_CONCURRENCY = _env_int("EZMETA_EFETCH_MAX_CONCURRENCY", 3)
+
+# NCBI rate limiting
+NCBI_RATE_LIMIT = _env_float("EZMETA_NCBI_RATE_LIMIT", 3.0)
+NCBI_RATE_LIMIT_WITH_KEY = _env_float("EZMETA_NCBI_RATE_LIMIT_WITH_KEY", 10.0)
+NCBI_RATE_BURST = _env_float("EZMETA_NCBI_RATE_BURST", 1.0)
+NCBI_RATE_LIMIT_DIR = os.environ.get(
+    "EZMETA_NCBI_RATE_LIMIT_DIR",
+    os.path.join(tempfile.gettempdir(), "ezmeta-ratelimit")
+)
+NCBI_MAX_RETRIES = _env_int("EZMETA_NCBI_MAX_RETRIES", 5)
+NCBI_BACKOFF_BASE = _env_float("EZMETA_NCBI_BACKOFF_BASE", 0.5)
+NCBI_BACKOFF_MAX = _env_float("EZMETA_NCBI_BACKOFF_MAX", 30.0)
+
+# Shared HTTP client
+HTTP_MAX_CONNECTIONS = _env_int("EZMETA_HTTP_MAX_CONNECTIONS", 20)
+HTTP_MAX_KEEPALIVE_CONNECTIONS = _env_int("EZMETA_HTTP_MAX_KEEPALIVE_CONNECTIONS", 10)
+HTTP_KEEPALIVE_EXPIRY = _env_float("EZMETA_HTTP_KEEPALIVE_EXPIRY", 60.0)
+HTTP_CONNECT_TIMEOUT = _env_float("EZMETA_HTTP_CONNECT_TIMEOUT", 10.0)
+HTTP_READ_TIMEOUT = _env_float("EZMETA_HTTP_READ_TIMEOUT", 120.0)
+HTTP_WRITE_TIMEOUT = _env_float("EZMETA_HTTP_WRITE_TIMEOUT", 30.0)
+HTTP_POOL_TIMEOUT = _env_float("EZMETA_HTTP_POOL_TIMEOUT", 30.0)
+HTTP2 = os.environ.get("EZMETA_HTTP2", "1").lower() not in ("0", "false", "no")
+
+# Metadata cache (an empty path disables it)
+CACHE_PATH = os.environ.get(
+    "EZMETA_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "ezmeta-cache.sqlite3")
+)
+CACHE_TTL = _env_float("EZMETA_CACHE_TTL", 7 * 24 * 3600)
+CACHE_MAX_ENTRIES = _env_int("EZMETA_CACHE_MAX_ENTRIES", 200_000)
+
+# ESearch cache (a TTL of 0 disables it)
+SEARCH_CACHE_TTL = _env_float("EZMETA_SEARCH_CACHE_TTL", 300.0)
+SEARCH_CACHE_MAX_ENTRIES = _env_int("EZMETA_SEARCH_CACHE_MAX_ENTRIES", 1024)
+SEARCH_CACHE_SHARED = os.environ.get("EZMETA_SEARCH_CACHE_SHARED", "0").lower() in ("1", "true", "yes")
+
+# Bulk jobs
+JOB_DIR = os.environ.get(
+    "EZMETA_JOB_DIR",
+    os.path.join(tempfile.gettempdir(), "ezmeta-jobs")
+)
+JOB_CHUNK_SIZE = _env_int("EZMETA_JOB_CHUNK_SIZE", 500)
+JOB_MAX_CONCURRENCY = _env_int("EZMETA_JOB_MAX_CONCURRENCY", 2)
+JOB_RESCAN_INTERVAL = _env_float("EZMETA_JOB_RESCAN_INTERVAL", 30.0)
+JOB_TTL = _env_float("EZMETA_JOB_TTL", 7 * 24 * 3600.0)
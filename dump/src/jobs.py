@@ -0,0 +1,352 @@
+import asyncio
+import fcntl
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+import pandas as pd
+from starlette.concurrency import run_in_threadpool
+
+from cache import MetadataCache
+from requests import fetch_metadata, search_all_ncbi_ids
+from rename import source_columns, select_and_rename_common_columns, to_ndjson
+from schema import EzMetaJobRequest, EzMetaJobStatus
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class JobManager:
+    """
+    Runs bulk fetch jobs in the background and keeps their state in a spool directory.
+
+    Every job has its own directory holding a manifest, the resolved ID list and
+    one NDJSON file per completed chunk. A worker only runs a job while it holds
+    the job's lock file, so whichever worker finds a job abandoned (e.g. after a
+    restart) resumes it from its last completed chunk. A failed job keeps its
+    completed chunks and resumes from them when retried.
+
+    Completed and failed jobs are deleted once they have not been updated for
+    ``ttl`` seconds (never when ``ttl`` is 0). Chunks are renamed and written
+    in the thread pool, away from the event loop.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        client: httpx.AsyncClient,
+        metadata_cache: Optional[MetadataCache] = None,
+        chunk_size: int = 500,
+        max_concurrency: int = 2,
+        ttl: float = 0
+    ):
+        self.spool_dir = spool_dir
+        self.client = client
+        self.metadata_cache = metadata_cache
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.ttl = ttl
+        self._tasks: Dict[str, asyncio.Task] = {}
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def create(self, request: EzMetaJobRequest) -> EzMetaJobStatus:
+        """Register a job and start running it."""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._path(job_id))
+
+        now = time.time()
+        manifest = {
+            "job_id": job_id,
+            "state": PENDING,
+            "request": request.model_dump(),
+            "chunk_size": self.chunk_size,
+            "total_ids": None,
+            "chunks_total": None,
+            "chunks_done": [],
+            "records": 0,
+            "created": now,
+            "updated": now,
+            "error": None
+        }
+        self._write_manifest(job_id, manifest)
+        self._start(job_id)
+        return self._status(manifest)
+
+    def status(self, job_id: str) -> Optional[EzMetaJobStatus]:
+        manifest = self._read_manifest(job_id)
+        return self._status(manifest) if manifest is not None else None
+
+    def iter_results(self, job_id: str) -> Iterator[bytes]:
+        """Yield the NDJSON results of the chunks completed so far, in chunk order."""
+        manifest = self._read_manifest(job_id)
+        if manifest is None:
+            # Deleted in the meantime
+            return
+        for index in sorted(manifest["chunks_done"]):
+            with open(self._chunk_path(job_id, index), "rb") as file:
+                yield file.read()
+
+    def retry(self, job_id: str) -> Optional[EzMetaJobStatus]:
+        """Restart a failed job from its last completed chunk."""
+        if self._read_manifest(job_id) is None:
+            return None
+        lock = self._claim(job_id)
+        if lock is None:
+            # Still being run, possibly by another worker
+            return self.status(job_id)
+
+        try:
+            manifest = self._read_manifest(job_id)
+            if manifest["state"] != FAILED:
+                return self._status(manifest)
+            manifest["state"] = PENDING
+            manifest["error"] = None
+            self._write_manifest(job_id, manifest)
+        finally:
+            os.close(lock)
+
+        self._start(job_id)
+        return self._status(manifest)
+
+    async def delete(self, job_id: str) -> Optional[bool]:
+        """
+        Delete a job and its results, stopping it first if this worker runs it.
+
+        Returns None for an unknown job, and False when another worker is
+        running it.
+        """
+        if self._read_manifest(job_id) is None:
+            return None
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return await run_in_threadpool(self._remove, job_id)
+
+    def prune(self):
+        """Delete the completed and failed jobs not updated for ``ttl`` seconds."""
+        expired = time.time() - self.ttl
+        for job_id in os.listdir(self.spool_dir):
+            manifest = self._read_manifest(job_id)
+            if manifest is not None and self._expired(manifest, expired):
+                self._remove(job_id, expired)
+
+    def resume_all(self):
+        """Start every unfinished job in the spool directory not running in this worker."""
+        for job_id in os.listdir(self.spool_dir):
+            manifest = self._read_manifest(job_id)
+            if manifest is not None and manifest["state"] in (PENDING, RUNNING):
+                self._start(job_id)
+
+    async def watch(self, interval: float):
+        """Periodically pick up jobs abandoned by other workers and delete expired ones."""
+        while True:
+            await asyncio.sleep(interval)
+            self.resume_all()
+            if self.ttl:
+                await run_in_threadpool(self.prune)
+
+    async def close(self):
+        """Stop the jobs of this worker; they are resumed by the next one to start."""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _start(self, job_id: str):
+        if job_id not in self._tasks:
+            self._tasks[job_id] = asyncio.ensure_future(self._run(job_id))
+
+    async def _run(self, job_id: str):
+        lock = self._claim(job_id)
+        if lock is None:
+            # Another worker is running the job
+            self._tasks.pop(job_id, None)
+            return
+
+        manifest = self._read_manifest(job_id)
+        # Chunks complete concurrently; the manifest is written by one at a time
+        manifest_lock = asyncio.Lock()
+
+        async def save_manifest():
+            async with manifest_lock:
+                await run_in_threadpool(self._write_manifest_content, job_id, self._dump_manifest(manifest))
+
+        try:
+            if manifest is None or manifest["state"] not in (PENDING, RUNNING):
+                # Finished, or deleted since the job was started
+                return
+
+            request = EzMetaJobRequest(**manifest["request"])
+            manifest["state"] = RUNNING
+            await save_manifest()
+
+            ids = await run_in_threadpool(self._read_ids, job_id)
+            if ids is None:
+                ids = await self._resolve_ids(request)
+                await run_in_threadpool(self._write_ids, job_id, ids)
+            if manifest["chunks_total"] is None:
+                # Also reached when the worker died between writing the IDs and the manifest
+                manifest["total_ids"] = len(ids)
+                manifest["chunks_total"] = -(-len(ids) // manifest["chunk_size"])
+                await save_manifest()
+
+            chunk_size = manifest["chunk_size"]
+            done = set(manifest["chunks_done"])
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def run_chunk(index: int):
+                async with semaphore:
+                    data = await fetch_metadata(
+                        self.client,
+                        ids[index * chunk_size:(index + 1) * chunk_size],
+                        request.api_key,
+                        fields=source_columns(request.fields, request.layout),
+                        cache=self.metadata_cache
+                    )
+                records = await run_in_threadpool(self._write_chunk, job_id, index, data, request)
+
+                manifest["chunks_done"].append(index)
+                manifest["records"] += records
+                await save_manifest()
+
+            tasks = [
+                asyncio.ensure_future(run_chunk(index))
+                for index in range(manifest["chunks_total"]) if index not in done
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # A failed chunk stops the others before the job is marked as failed
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            manifest["state"] = COMPLETED
+            await save_manifest()
+
+        except asyncio.CancelledError:
+            # Left as running, to be resumed from the last completed chunk
+            raise
+        except Exception as e:
+            manifest["state"] = FAILED
+            manifest["error"] = str(e)
+            await save_manifest()
+        finally:
+            os.close(lock)
+            self._tasks.pop(job_id, None)
+
+    async def _resolve_ids(self, request: EzMetaJobRequest) -> List[int]:
+        search_ids = await search_all_ncbi_ids(
+            self.client, request.terms, request.max_results, request.api_key
+        ) if request.terms else []
+
+        # Keep the search order, followed by the provided IDs
+        ids = list(dict.fromkeys(search_ids + (request.ids or [])))
+        return ids[:request.max_results]
+
+    def _claim(self, job_id: str) -> Optional[int]:
+        """Take the job's lock without waiting; it is released when the process dies."""
+        try:
+            fd = os.open(os.path.join(self._path(job_id), "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            # The job was deleted
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _remove(self, job_id: str, expired: Optional[float] = None) -> bool:
+        """Delete a job unless it is running, or, with ``expired``, unless it was updated since."""
+        lock = self._claim(job_id)
+        if lock is None:
+            return False
+        try:
+            manifest = self._read_manifest(job_id)
+            if expired is not None and (manifest is None or not self._expired(manifest, expired)):
+                # Retried or deleted in the meantime
+                return False
+            # Files of a chunk still being written by a cancelled run may remain
+            shutil.rmtree(self._path(job_id), ignore_errors=True)
+        finally:
+            os.close(lock)
+        return True
+
+    @staticmethod
+    def _expired(manifest: Dict[str, Any], expired: float) -> bool:
+        return manifest["state"] in (COMPLETED, FAILED) and manifest["updated"] < expired
+
+    def _path(self, job_id: str) -> str:
+        if not _JOB_ID.fullmatch(job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.spool_dir, job_id)
+
+    def _chunk_path(self, job_id: str, index: int) -> str:
+        return os.path.join(self._path(job_id), f"chunk-{index:06d}.ndjson")
+
+    def _read_manifest(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self._path(job_id), "job.json")) as file:
+                return json.load(file)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def _write_manifest(self, job_id: str, manifest: Dict[str, Any]):
+        self._write_manifest_content(job_id, self._dump_manifest(manifest))
+
+    def _write_manifest_content(self, job_id: str, content: str):
+        self._write_atomic(os.path.join(self._path(job_id), "job.json"), content)
+
+    @staticmethod
+    def _dump_manifest(manifest: Dict[str, Any]) -> str:
+        manifest["updated"] = time.time()
+        return json.dumps(manifest)
+
+    def _read_ids(self, job_id: str) -> Optional[List[int]]:
+        try:
+            with open(os.path.join(self._path(job_id), "ids.json")) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _write_ids(self, job_id: str, ids: List[int]):
+        self._write_atomic(os.path.join(self._path(job_id), "ids.json"), json.dumps(ids))
+
+    def _write_chunk(self, job_id: str, index: int, data: pd.DataFrame, request: EzMetaJobRequest) -> int:
+        """Write the renamed records of a chunk, returning their number."""
+        result = select_and_rename_common_columns(data, request.fields, request.layout)
+        self._write_atomic(self._chunk_path(job_id, index), to_ndjson(result))
+        return len(result)
+
+    @staticmethod
+    def _write_atomic(path: str, content: str):
+        # Readers in other workers never see a partially written file
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as file:
+            file.write(content)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _status(manifest: Dict[str, Any]) -> EzMetaJobStatus:
+        return EzMetaJobStatus(
+            job_id=manifest["job_id"],
+            state=manifest["state"],
+            total_ids=manifest["total_ids"],
+            chunks_total=manifest["chunks_total"],
+            chunks_done=len(manifest["chunks_done"]),
+            records=manifest["records"],
+            created=manifest["created"],
+            updated=manifest["updated"],
+            error=manifest["error"]
+        )
@@ -1,21 +1,125 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
 import httpx
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from cache import MetadataCache, SharedTTLCache, TTLCache
+from client import create_client
+from columnar import negotiate_media_type, pyarrow_available, to_columnar
+from config import (
+    CACHE_PATH,
+    CACHE_TTL,
+    CACHE_MAX_ENTRIES,
+    SEARCH_CACHE_TTL,
+    SEARCH_CACHE_MAX_ENTRIES,
+    SEARCH_CACHE_SHARED,
+    JOB_DIR,
+    JOB_CHUNK_SIZE,
+    JOB_MAX_CONCURRENCY,
+    JOB_RESCAN_INTERVAL,
+    JOB_TTL,
+)
+from requests import (
+    search_ncbi_ids,
+    search_ncbi_history,
+    fetch_metadata,
+    fetch_history_metadata,
+    iter_metadata,
+    iter_history_metadata,
+    count_ncbi_records,
+)
+from jobs import JobManager
+from rename import (
+    source_columns,
+    select_and_rename_common_columns,
+    convert_column_types,
+    to_ndjson,
+)
+from schema import EzMetaFetchResponse, EzMetaFetchRequest, EzMetaJobRequest, EzMetaJobStatus
+from table import RecordTable
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 
-from requests import NCBI_ESEARCH_URL, DATABASE, search_ncbi_ids, fetch_metadata
-from rename import select_and_rename_common_columns
-from schema import EzMetaFetchResponse, EzMetaFetchRequest
+def create_search_cache():
+    if not SEARCH_CACHE_TTL:
+        return None
+    if SEARCH_CACHE_SHARED and CACHE_PATH:
+        return SharedTTLCache(CACHE_PATH, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES)
+    return TTLCache(SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.metadata_cache = (
+        MetadataCache(CACHE_PATH, CACHE_TTL, CACHE_MAX_ENTRIES) if CACHE_PATH else None
+    )
+    app.state.search_cache = create_search_cache()
+    async with create_client() as client:
+        app.state.http_client = client
+        app.state.jobs = JobManager(
+            JOB_DIR,
+            client,
+            app.state.metadata_cache,
+            chunk_size=JOB_CHUNK_SIZE,
+            max_concurrency=JOB_MAX_CONCURRENCY,
+            ttl=JOB_TTL
+        )
+        app.state.jobs.resume_all()
+        watcher = asyncio.create_task(app.state.jobs.watch(JOB_RESCAN_INTERVAL))
+        yield
+        watcher.cancel()
+        await app.state.jobs.close()
+    for cache in (app.state.metadata_cache, app.state.search_cache):
+        if cache is not None:
+            cache.close()
 
 
 app = FastAPI(
     title="EzMetaFetch API",
     description="API for fetching metadata from NCBI databases",
-    root_path="/api/v1/dump"
+    root_path="/api/v1/dump",
+    lifespan=lifespan
 )
 
 
+async def stream_ndjson(
+    batches: AsyncIterator[List[Dict[str, Any]]],
+    fields: Optional[List[str]] = None,
+    layout: str = "experiment"
+) -> AsyncIterator[str]:
+    """
+    Render batches of records as renamed NDJSON records.
+
+    The status code is already sent when a batch fails, so the error is
+    reported as a last line with ``status`` set to ``error``.
+    """
+    try:
+        async for records in batches:
+            table = RecordTable(source_columns(fields, layout))
+            table.extend(records)
+            yield to_ndjson(select_and_rename_common_columns(table.to_frame(), fields, layout))
+    except Exception as e:
+        yield json.dumps({"status": "error", "message": f"Error processing request: {str(e)}"}) + "\n"
+
+
 @app.post("/fetch", response_model=EzMetaFetchResponse)
-async def fetch_metadata_handler(request: EzMetaFetchRequest):
-    """Fetch metadata from NCBI databases using ezmetafetch"""
+async def fetch_metadata_handler(
+    request: EzMetaFetchRequest,
+    accept: Optional[str] = Header(default=None)
+):
+    """
+    Fetch metadata from NCBI databases using ezmetafetch
+
+    Records are streamed as NDJSON when `stream` is set or the client accepts
+    `application/x-ndjson`. Clients accepting `application/vnd.apache.arrow.stream`
+    or `application/vnd.apache.parquet` get the metadata table in that format.
+    """
     # Validate input
     if not request.terms and not request.ids:
         raise HTTPException(
@@ -23,45 +127,105 @@ async def fetch_metadata_handler(request: EzMetaFetchRequest):
             detail="Either terms or ids must be provided"
         )
 
+    if request.use_history and request.ids:
+        raise HTTPException(
+            status_code=400,
+            detail="ids cannot be combined with use_history"
+        )
+
+    columnar_media_type = negotiate_media_type(accept)
+    if columnar_media_type and not pyarrow_available():
+        raise HTTPException(
+            status_code=406,
+            detail="pyarrow is required for Arrow and Parquet output"
+        )
+
     try:
-        async with httpx.AsyncClient() as client:
+        client = app.state.http_client
+        fields = source_columns(request.fields, request.layout)
+
+        if request.use_history:
+            # Page through the results on the history server without exchanging IDs
+            history = await search_ncbi_history(client, request.terms, request.api_key)
+            search_ids, all_ids = None, None
+        else:
             # Step 1: Search for IDs if terms are provided
             search_ids = await search_ncbi_ids(
                 client,
                 request.terms,
                 request.max_results,
-                request.api_key
+                request.api_key,
+                cache=app.state.search_cache
             ) if request.terms else []
 
             # Combine with provided IDs if any
             provided_ids = request.ids or []
             all_ids = list(set(search_ids).union(set(provided_ids)))[:request.max_results]
 
-            # Step 2: Fetch metadata for all IDs
-            if all_ids:
-                data = await fetch_metadata(client, all_ids, request.api_key)
+        # Step 2: Fetch metadata for all IDs
+        if request.stream or NDJSON_MEDIA_TYPE in (accept or ""):
+            if request.use_history:
+                batches = iter_history_metadata(
+                    client, history, request.max_results, request.api_key, fields=fields
+                )
+            else:
+                batches = iter_metadata(
+                    client,
+                    all_ids,
+                    request.api_key,
+                    fields=fields,
+                    cache=app.state.metadata_cache
+                )
+            return StreamingResponse(
+                stream_ndjson(batches, request.fields, request.layout),
+                media_type=NDJSON_MEDIA_TYPE
+            )
+
+        if request.use_history:
+            data = await fetch_history_metadata(
+                client,
+                history,
+                request.max_results,
+                request.api_key,
+                fields=fields
+            )
+        else:
+            data = await fetch_metadata(
+                client,
+                all_ids,
+                request.api_key,
+                fields=fields,
+                cache=app.state.metadata_cache
+            )
 
-                if not data.empty:
-                    result = select_and_rename_common_columns(data)
-                    metadata_dict = result.to_dict('split')
+        if columnar_media_type:
+            result = convert_column_types(select_and_rename_common_columns(data, request.fields, request.layout))
+            return Response(
+                content=to_columnar(result, columnar_media_type),
+                media_type=columnar_media_type
+            )
 
-                    return EzMetaFetchResponse(
-                        search_ids=search_ids,
-                        ids=all_ids,
-                        metadata=metadata_dict,
-                        status="success",
-                        message=f"Retrieved metadata for {len(result)} records"
-                    )
+        if not data.empty:
+            result = select_and_rename_common_columns(data, request.fields, request.layout)
+            metadata_dict = result.to_dict('split')
 
-            # Return empty result if no IDs or no data found
             return EzMetaFetchResponse(
                 search_ids=search_ids,
-                ids=all_ids if all_ids else [],
-                metadata={},
+                ids=all_ids,
+                metadata=metadata_dict,
                 status="success",
-                message="No records found matching the criteria"
+                message=f"Retrieved metadata for {len(result)} records"
             )
 
+        # Return empty result if no IDs or no data found
+        return EzMetaFetchResponse(
+            search_ids=search_ids,
+            ids=all_ids,
+            metadata={},
+            status="success",
+            message="No records found matching the criteria"
+        )
+
     except httpx.HTTPError as e:
         status_code = 500
         if hasattr(e, 'response') and e.response is not None:
@@ -78,22 +242,79 @@ async def fetch_metadata_handler(request: EzMetaFetchRequest):
         )
 
 
+@app.post("/jobs", response_model=EzMetaJobStatus, status_code=202)
+async def create_job(request: EzMetaJobRequest):
+    """Start a bulk fetch job in the background"""
+    if not request.terms and not request.ids:
+        raise HTTPException(
+            status_code=400,
+            detail="Either terms or ids must be provided"
+        )
+    return app.state.jobs.create(request)
+
+
+@app.get("/jobs/{job_id}", response_model=EzMetaJobStatus)
+async def job_status(job_id: str):
+    """Get the progress of a bulk fetch job"""
+    status = app.state.jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@app.post("/jobs/{job_id}/retry", response_model=EzMetaJobStatus, status_code=202)
+async def retry_job(job_id: str):
+    """Restart a failed bulk fetch job from its last completed chunk"""
+    status = app.state.jobs.retry(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@app.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str):
+    """Delete a bulk fetch job and its results, stopping it if it is running"""
+    deleted = await app.state.jobs.delete(job_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not deleted:
+        raise HTTPException(status_code=409, detail="Job is running in another worker")
+    return Response(status_code=204)
+
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str):
+    """Download the records of the chunks a job has completed so far, as NDJSON"""
+    if app.state.jobs.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        app.state.jobs.iter_results(job_id),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/cache")
+async def cache_stats():
+    """Get hit/miss counters and size of the metadata cache"""
+    cache = app.state.metadata_cache
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await run_in_threadpool(cache.stats)}
+
+
 @app.get("/peek")
 async def peek(term: str = Query(..., description="Search term to query NCBI")):
     """Get count of records matching a term in NCBI SRA database"""
     try:
-        url = f"{NCBI_ESEARCH_URL}?db={DATABASE}&term={term}&rettype=count&retmode=json"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
-            count = data.get("esearchresult", {}).get("count", "0")
-            return {"count": count}
+        count = await count_ncbi_records(
+            app.state.http_client, term, cache=app.state.search_cache
+        )
+        return {"count": count}
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -0,0 +1,298 @@
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set
+from xml.etree import ElementTree
+
+# Record key holding the SRA files of all runs, collected while parsing
+SRA_FILES_FIELD = "SRAFiles"
+SRA_FILE_PATH = "RUN_SET.RUN.SRAFiles.SRAFile"
+# Record key holding one flattened record per run, when a projection asks for it
+RUNS_FIELD = "Runs"
+RUN_PATH = "RUN_SET.RUN"
+# Namespace ElementTree never declares
+XML_NAMESPACE_PREFIX = "xml"
+
+
+def _name(tag: str) -> str:
+    """Render ``{uri}name`` the way ``xmltodict(process_namespaces=True)`` does."""
+    if tag.startswith("{"):
+        uri, _, local = tag[1:].partition("}")
+        return f"{uri}:{local}"
+    return tag
+
+
+def _text(element: ElementTree.Element) -> Optional[str]:
+    text = element.text.strip() if element.text else ""
+    return text or None
+
+
+def namespace_declarations(element: ElementTree.Element) -> Dict[str, str]:
+    """
+    Namespace declarations ``ElementTree.tostring(element)`` writes, by prefix.
+
+    Each part of a record used to be serialized on its own and parsed again by
+    ``xmltodict``, which keeps these declarations under ``@xmlns``. Prefixes
+    are numbered and sorted the way ``ElementTree`` does it.
+    """
+    prefixes: Dict[str, str] = {}
+    for node in element.iter():
+        for name in (node.tag, *node.attrib):
+            if name[:1] != "{":
+                continue
+            uri = name[1:name.index("}")]
+            if uri not in prefixes:
+                prefix = ElementTree._namespace_map.get(uri) or f"ns{len(prefixes)}"
+                if prefix != XML_NAMESPACE_PREFIX:
+                    prefixes[uri] = prefix
+    return {prefix: uri for uri, prefix in sorted(prefixes.items(), key=lambda item: item[1])}
+
+
+def element_to_dict(element: ElementTree.Element, declarations: Optional[Dict[str, str]] = None) -> Any:
+    """
+    Convert an element to the nested value ``xmltodict`` would produce for it.
+
+    ``declarations`` are the namespace declarations written on the element,
+    see :func:`namespace_declarations`.
+    """
+    text = _text(element)
+    if not element.attrib and not len(element) and not declarations:
+        return text
+
+    value: Dict[str, Any] = {f"@{_name(k)}": v for k, v in element.attrib.items()}
+    if declarations:
+        value["@xmlns"] = dict(declarations)
+    for child in element:
+        key = _name(child.tag)
+        child_value = element_to_dict(child)
+        if key not in value:
+            value[key] = child_value
+        elif isinstance(value[key], list):
+            value[key].append(child_value)
+        else:
+            value[key] = [value[key], child_value]
+
+    if text is not None:
+        value["#text"] = text
+    return value
+
+
+def _flatten(
+    element: ElementTree.Element,
+    path: str,
+    row: Dict[str, Any],
+    declarations: Optional[Dict[str, str]] = None
+):
+    text = _text(element)
+    if not element.attrib and not len(element) and not declarations:
+        row[path] = text
+        return
+
+    for key, value in element.attrib.items():
+        row[f"{path}.@{_name(key)}"] = value
+    if declarations:
+        for prefix, uri in declarations.items():
+            row[f"{path}.@xmlns.{prefix}"] = uri
+
+    counts = Counter(child.tag for child in element)
+    for child in element:
+        child_path = f"{path}.{_name(child.tag)}"
+        if counts[child.tag] > 1:
+            # Repeated elements stay a list of nested dicts, as json_normalize leaves them
+            row.setdefault(child_path, []).append(element_to_dict(child))
+        else:
+            _flatten(child, child_path, row)
+
+    if text is not None:
+        row[f"{path}.#text"] = text
+
+
+def collect_sra_files(
+    element: ElementTree.Element,
+    path: str = SRA_FILE_PATH
+) -> List[Dict[str, Any]]:
+    """
+    Collect the SRA files below ``element``, by default those of every run of a record.
+
+    Each file keeps its attributes (``@url``, ``@filename``, ``@size``,
+    ``@semantic_name``, ...) and the attributes of its mirrors under
+    ``Alternatives``, which is always a list.
+    """
+    files = []
+    for sra_file in element.iterfind(path.replace(".", "/")):
+        entry: Dict[str, Any] = {f"@{_name(k)}": v for k, v in sra_file.attrib.items()}
+        entry["Alternatives"] = [
+            {f"@{_name(k)}": v for k, v in alternative.attrib.items()}
+            for alternative in sra_file.iterfind("Alternatives")
+        ]
+        files.append(entry)
+    return files
+
+
+class Projection:
+    """Set of column paths to extract, along with every path leading to them."""
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields: Set[str] = set(fields)
+        self.sra_files = SRA_FILES_FIELD in self.fields
+        self.runs = RUNS_FIELD in self.fields
+        # Elements kept whole while streaming
+        self.subtrees: Set[str] = self.fields | ({SRA_FILE_PATH} if self.sra_files else set())
+        self.prefixes: Set[str] = set()
+        for field in self.subtrees:
+            parts = field.split(".")
+            self.prefixes.update(".".join(parts[:i]) for i in range(1, len(parts)))
+
+    def wants(self, path: str) -> bool:
+        return path in self.fields or path in self.prefixes
+
+
+def _project(
+    element: ElementTree.Element,
+    path: str,
+    row: Dict[str, Any],
+    projection: Projection,
+    declarations: Optional[Dict[str, str]] = None
+):
+    if path in projection.fields:
+        if not element.attrib and not len(element) and not declarations:
+            row[path] = _text(element)
+        else:
+            row[path] = element_to_dict(element, declarations)
+        return
+
+    for key, value in element.attrib.items():
+        attribute_path = f"{path}.@{_name(key)}"
+        if attribute_path in projection.fields:
+            row[attribute_path] = value
+    if declarations:
+        for prefix, uri in declarations.items():
+            declaration_path = f"{path}.@xmlns.{prefix}"
+            if declaration_path in projection.fields:
+                row[declaration_path] = uri
+
+    counts = Counter(child.tag for child in element)
+    for child in element:
+        child_path = f"{path}.{_name(child.tag)}"
+        if counts[child.tag] > 1:
+            if child_path in projection.fields:
+                row.setdefault(child_path, []).append(element_to_dict(child))
+        elif projection.wants(child_path):
+            _project(child, child_path, row, projection)
+
+    text = _text(element)
+    if text is not None and f"{path}.#text" in projection.fields:
+        row[f"{path}.#text"] = text
+
+
+def flatten_record(
+    record: ElementTree.Element,
+    projection: Optional[Projection] = None,
+    namespaced: bool = True
+) -> Dict[str, Any]:
+    """
+    Flatten a record (e.g. ``EXPERIMENT_PACKAGE``) into a dict of column paths.
+
+    Keys follow ``pd.json_normalize(xmltodict.parse(...))``: nested elements are
+    joined with dots, attributes are prefixed with ``@`` and the text of an
+    element with attributes is stored under ``#text``. The namespaces used in
+    each child of the record are declared under its ``@xmlns`` key, unless
+    ``namespaced`` tells the record has no namespaced names to look for.
+
+    With a ``projection`` only its fields are extracted and the rest of the
+    record is never visited. A projected field pointing at an element with
+    children holds that element as a nested dict.
+
+    The SRA files of the record are collected under ``SRA_FILES_FIELD``,
+    unless a projection leaves that field out. A projection holding
+    ``RUNS_FIELD`` also gets the list of its runs, each projected on its own
+    with keys starting with ``RUN_SET.RUN``.
+    """
+    row: Dict[str, Any] = {}
+    for child in record:
+        path = _name(child.tag)
+        if projection is None:
+            _flatten(child, path, row, namespace_declarations(child) if namespaced else None)
+        elif projection.wants(path):
+            _project(child, path, row, projection, namespace_declarations(child) if namespaced else None)
+
+    if projection is None or projection.sra_files:
+        row[SRA_FILES_FIELD] = collect_sra_files(record)
+    if projection is not None and projection.runs:
+        row[RUNS_FIELD] = [
+            _flatten_run(run, projection) for run in record.iterfind(RUN_PATH.replace(".", "/"))
+        ]
+    return row
+
+
+def _flatten_run(run: ElementTree.Element, projection: Projection) -> Dict[str, Any]:
+    # Projected like a record of its own, so run fields are found whether or
+    # not the experiment has several runs
+    row: Dict[str, Any] = {}
+    _project(run, RUN_PATH, row, projection)
+    if projection.sra_files:
+        row[SRA_FILES_FIELD] = collect_sra_files(run, "SRAFiles.SRAFile")
+    return row
+
+
+class RecordStreamParser:
+    """
+    Incremental parser turning an EFetch XML stream into flat records.
+
+    Bytes are fed as they arrive from the network. Every direct child of the
+    document root is flattened as soon as its end tag is read and then dropped,
+    so at most one record is kept in memory. When ``fields`` are given, elements
+    outside of them are also emptied as soon as they are complete.
+    """
+
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        self._parser = ElementTree.XMLPullParser(events=("start", "end", "start-ns"))
+        self._projection = Projection(fields) if fields is not None else None
+        # Namespaced names are only looked for once the document declares a namespace
+        self._namespaced = False
+        self._root: Optional[ElementTree.Element] = None
+        # (path, inside a projected field) of the open elements below the record
+        self._stack: List[tuple] = []
+        self._depth = 0
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        """Feed a piece of the document and return the records completed by it."""
+        self._parser.feed(data)
+        return self._read_records()
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Finish parsing and return the remaining records."""
+        self._parser.close()
+        return self._read_records()
+
+    def _read_records(self) -> List[Dict[str, Any]]:
+        records = []
+        for event, element in self._parser.read_events():
+            if event == "start-ns":
+                self._namespaced = True
+                continue
+            if event == "start":
+                if self._root is None:
+                    self._root = element
+                self._depth += 1
+                if self._projection is not None and self._depth > 2:
+                    self._push(element)
+                continue
+
+            self._depth -= 1
+            if self._depth == 1:
+                records.append(flatten_record(element, self._projection, self._namespaced))
+                element.clear()
+                self._root.remove(element)
+            elif self._projection is not None and self._depth > 1:
+                path, keep = self._stack.pop()
+                if not keep and path not in self._projection.prefixes:
+                    element.clear()
+        return records
+
+    def _push(self, element: ElementTree.Element):
+        if self._stack:
+            parent_path, parent_keep = self._stack[-1]
+            path = f"{parent_path}.{_name(element.tag)}"
+        else:
+            parent_keep = False
+            path = _name(element.tag)
+        self._stack.append((path, parent_keep or path in self._projection.subtrees))
@@ -1,7 +1,10 @@
-import json
+from typing import Any, Dict, List, Optional
 
+import numpy as np
 import pandas as pd
 
+from parser import RUN_PATH, RUNS_FIELD, SRA_FILES_FIELD
+
 
 # Define the mapping for common metadata fields
 COLUMN_RENAME_MAP = {
@@ -33,38 +36,128 @@ COLUMN_RENAME_MAP = {
     "RUN_SET.RUN.@size": "File Size (bytes)",
 }
 
+# Renamed columns holding integers, typed in columnar output
+INTEGER_COLUMNS = ["Taxon ID", "Total Spots", "Total Bases", "File Size (bytes)"]
+
+# Columns read by select_and_rename_common_columns
+SOURCE_COLUMNS = [*COLUMN_RENAME_MAP, SRA_FILES_FIELD]
+
+# Renamed columns describing a single run
+RUN_COLUMNS = {k: v for k, v in COLUMN_RENAME_MAP.items() if k.startswith(f"{RUN_PATH}.")}
+
+
+def source_columns(fields: Optional[List[str]] = None, layout: str = "experiment") -> List[str]:
+    """Columns to extract from the XML for the given extra fields and row layout."""
+    columns = SOURCE_COLUMNS + [f for f in fields or [] if f not in SOURCE_COLUMNS]
+    return columns if layout == "experiment" else columns + [RUNS_FIELD]
+
 
-# Extract download links from 'RUN_SET.RUN.SRAFiles.SRAFile'
-def extract_links(entry):
-    try:
-        files = json.loads(entry) if isinstance(entry, str) else entry
-        if isinstance(files, list):
-            return [f.get("@url") for f in files if "@url" in f]
-        elif isinstance(files, dict):
-            return [files.get("@url")] if "@url" in files else []
-        return []
-    except Exception:
-        return []
+def _download_columns(files: List[Optional[List[Dict[str, Any]]]]) -> Dict[str, list]:
+    return {
+        "Download Links": [
+            [f["@url"] for f in run_files if "@url" in f] if run_files else []
+            for run_files in files
+        ],
+        "Download Files": [run_files or [] for run_files in files]
+    }
 
 
-def select_and_rename_common_columns(df: pd.DataFrame) -> pd.DataFrame:
+def explode_runs(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn a DataFrame with one row per experiment package into one row per run.
+
+    Each package row is repeated once per run in its ``RUNS_FIELD`` list and
+    the run fields replace the package level ones. Packages without runs keep
+    a single row.
+    """
+    if RUNS_FIELD not in df.columns:
+        return df
+
+    runs = [run_list or [{}] for run_list in df[RUNS_FIELD]]
+    positions = np.repeat(np.arange(len(df)), [len(run_list) for run_list in runs])
+    exploded = df.drop(columns=RUNS_FIELD).iloc[positions].reset_index(drop=True)
+
+    run_frame = pd.DataFrame([run for run_list in runs for run in run_list], index=exploded.index)
+    for column in run_frame.columns:
+        if column in exploded.columns:
+            exploded[column] = run_frame[column].where(run_frame[column].notna(), exploded[column])
+        else:
+            exploded[column] = run_frame[column]
+    return exploded
+
+
+def _rename_runs(runs: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    renamed = []
+    for run in runs or []:
+        row = {target: run.get(source) for source, target in RUN_COLUMNS.items()}
+        downloads = _download_columns([run.get(SRA_FILES_FIELD)])
+        row.update((name, values[0]) for name, values in downloads.items())
+        renamed.append(row)
+    return renamed
+
+
+def select_and_rename_common_columns(
+    df: pd.DataFrame,
+    fields: Optional[List[str]] = None,
+    layout: str = "experiment"
+) -> pd.DataFrame:
     """
     Selects and renames common metadata columns in a sequencing experiments DataFrame,
-    and extracts all available download links into a 'Download Links' column.
+    and exposes the SRA files collected by the parser as a 'Download Links' column
+    (URLs) and a 'Download Files' column (file attributes and mirrors).
 
     Parameters:
         df (pd.DataFrame): Original DataFrame with flattened JSON column keys.
+        fields (List[str], optional): Extra flattened columns to keep under their own name.
+        layout (str): "experiment" for one row per experiment package, "run" for one
+            row per run, or "nested" for one row per package with its renamed runs
+            in a 'Runs' column. The last two need the columns of ``source_columns``
+            for that layout.
 
     Returns:
         pd.DataFrame: Cleaned and renamed DataFrame with download links.
     """
+    if layout == "run":
+        df = explode_runs(df)
+
     # Filter existing columns for renaming
     existing = {k: v for k, v in COLUMN_RENAME_MAP.items() if k in df.columns}
-    cleaned_df = df[list(existing.keys())].rename(columns=existing)
 
-    if "RUN_SET.RUN.SRAFiles.SRAFile" in df.columns:
-        cleaned_df["Download Links"] = df["RUN_SET.RUN.SRAFiles.SRAFile"].apply(extract_links)
-    else:
-        cleaned_df["Download Links"] = [[] for _ in range(len(df))]
+    # Several paths map to the same name (e.g. the instrument model of each
+    # platform), so they are merged into one column
+    cleaned_df = pd.DataFrame(index=df.index)
+    for source, target in existing.items():
+        if target in cleaned_df.columns:
+            cleaned_df[target] = cleaned_df[target].where(cleaned_df[target].notna(), df[source])
+        else:
+            cleaned_df[target] = df[source]
+
+    for field in fields or []:
+        if field in df.columns and field not in SOURCE_COLUMNS:
+            cleaned_df[field] = df[field]
+
+    files = df[SRA_FILES_FIELD].tolist() if SRA_FILES_FIELD in df.columns else [None] * len(df)
+    for name, values in _download_columns(files).items():
+        cleaned_df[name] = values
+
+    if layout == "nested":
+        runs = df[RUNS_FIELD].tolist() if RUNS_FIELD in df.columns else [None] * len(df)
+        cleaned_df["Runs"] = [_rename_runs(run_list) for run_list in runs]
+
+    return cleaned_df
+
+
+def convert_column_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the numeric columns of a renamed DataFrame to nullable integers."""
+    df = df.copy()
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+    return df
+
 
-    return cleaned_df
\ No newline at end of file
+def to_ndjson(df: pd.DataFrame) -> str:
+    """Render a renamed DataFrame as NDJSON, one record per line."""
+    if df.empty:
+        return ""
+    return df.to_json(orient="records", lines=True).rstrip("\n") + "\n"
@@ -1,69 +1,498 @@
-from typing import List, Optional
-from xml.etree import ElementTree
+import asyncio
+import re
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 import httpx
 import pandas as pd
-import xmltodict
+from starlette.concurrency import run_in_threadpool
+
+import scheduler
+from cache import MetadataCache, TTLCache, projection_key
+from coalesce import SingleFlight
+from config import EFETCH_CHUNK_SIZE, EFETCH_MAX_CONCURRENCY
+from parser import RecordStreamParser
+from table import RecordTable
 
 NCBI_ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 NCBI_EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+NCBI_ESUMMARY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
 DATABASE = "sra"
+# Field of a record identifying it; EFetch records do not hold their UID
+EXPERIMENT_ACCESSION_FIELD = "EXPERIMENT.@accession"
+_SUMMARY_ACCESSION = re.compile(r'<Experiment\b[^>]*\bacc="([^"]+)"')
+# Largest number of IDs ESearch returns per request
+ESEARCH_PAGE_SIZE = 10_000
+
+
+class HistorySearch(NamedTuple):
+    """Search results kept on the Entrez history server."""
+    count: int
+    webenv: str
+    query_key: str
+
+# ESearch calls currently running, shared by identical concurrent searches
+_searches = SingleFlight()
+
+
+async def _cached_search(
+    key: Hashable,
+    cache: Optional[TTLCache],
+    search: Callable[[], Awaitable[Any]]
+) -> Any:
+    """Answer a search from the cache, or run it once for all concurrent callers."""
+    if cache is not None:
+        value = await cache.get(key)
+        if value is not None:
+            return value
+
+    async def run():
+        value = await search()
+        if cache is not None:
+            await cache.set(key, value)
+        return value
+
+    return await _searches.do(key, run)
 
 
 async def search_ncbi_ids(
+    client: httpx.AsyncClient,
+    terms: List[str],
+    max_results: int,
+    api_key: Optional[str] = None,
+    cache: Optional[TTLCache] = None
+) -> List[int]:
+    """
+    Search NCBI for IDs matching the given terms.
+
+    Results are kept in ``cache`` when given, and concurrent identical
+    searches share a single ESearch request.
+    """
+    key = ("esearch", tuple(sorted(terms)), max_results)
+    ids = await _cached_search(
+        key, cache, lambda: _search_ncbi_ids(client, terms, max_results, api_key)
+    )
+    return list(ids)
+
+
+async def _search_ncbi_ids(
     client: httpx.AsyncClient,
     terms: List[str],
     max_results: int,
     api_key: Optional[str] = None
 ) -> List[int]:
-    """Search NCBI for IDs matching the given terms."""
+    _, ids = await _search_page(client, terms, 0, max_results, api_key)
+    return ids
+
+
+async def _search_page(
+    client: httpx.AsyncClient,
+    terms: List[str],
+    retstart: int,
+    retmax: int,
+    api_key: Optional[str] = None
+) -> Tuple[int, List[int]]:
+    """Run one ESearch request, returning the total count and the page of IDs."""
     search_term = " OR ".join(terms)
     search_params = {
         "db": DATABASE,
         "term": search_term,
         "retmode": "json",
-        "retmax": max_results
+        "retstart": retstart,
+        "retmax": retmax
     }
 
     if api_key:
         search_params["api_key"] = api_key
 
-    search_response = await client.post(NCBI_ESEARCH_URL, data=search_params)
+    search_response = await scheduler.request(
+        client, "POST", NCBI_ESEARCH_URL, api_key=api_key, data=search_params
+    )
     search_response.raise_for_status()
-    search_data = search_response.json()
+    search_data = search_response.json().get("esearchresult", {})
 
-    return [int(id_str) for id_str in search_data.get("esearchresult", {}).get("idlist", [])]
+    return (
+        int(search_data.get("count", 0)),
+        [int(id_str) for id_str in search_data.get("idlist", [])]
+    )
 
 
-async def fetch_metadata(
+async def search_all_ncbi_ids(
     client: httpx.AsyncClient,
-    ids: List[int],
+    terms: List[str],
+    max_results: int,
+    api_key: Optional[str] = None,
+    max_concurrency: int = EFETCH_MAX_CONCURRENCY
+) -> List[int]:
+    """Search NCBI for up to ``max_results`` IDs, paging past the ESearch page limit."""
+    count, ids = await _search_page(
+        client, terms, 0, min(ESEARCH_PAGE_SIZE, max_results), api_key
+    )
+    total = min(count, max_results)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def search_page(retstart: int) -> List[int]:
+        async with semaphore:
+            _, page = await _search_page(
+                client, terms, retstart, min(ESEARCH_PAGE_SIZE, total - retstart), api_key
+            )
+        return page
+
+    pages = await asyncio.gather(*(
+        search_page(retstart) for retstart in range(ESEARCH_PAGE_SIZE, total, ESEARCH_PAGE_SIZE)
+    ))
+    for page in pages:
+        ids.extend(page)
+
+    return ids
+
+
+async def count_ncbi_records(
+    client: httpx.AsyncClient,
+    term: str,
+    api_key: Optional[str] = None,
+    cache: Optional[TTLCache] = None
+) -> str:
+    """Count the records matching a term in NCBI, cached and coalesced like searches."""
+    return await _cached_search(
+        ("count", term), cache, lambda: _count_ncbi_records(client, term, api_key)
+    )
+
+
+async def _count_ncbi_records(
+    client: httpx.AsyncClient,
+    term: str,
     api_key: Optional[str] = None
-) -> pd.DataFrame:
-    """Fetch metadata for the given IDs from NCBI."""
-    fetch_params = {
+) -> str:
+    count_params = {
         "db": DATABASE,
-        "id": ",".join(map(str, ids)),
-        "retmode": "xml"
+        "term": term,
+        "rettype": "count",
+        "retmode": "json"
+    }
+
+    if api_key:
+        count_params["api_key"] = api_key
+
+    count_response = await scheduler.request(
+        client, "GET", NCBI_ESEARCH_URL, api_key=api_key, params=count_params
+    )
+    count_response.raise_for_status()
+    count_data = count_response.json()
+
+    return count_data.get("esearchresult", {}).get("count", "0")
+
+
+async def search_ncbi_history(
+    client: httpx.AsyncClient,
+    terms: List[str],
+    api_key: Optional[str] = None
+) -> HistorySearch:
+    """
+    Search NCBI for the given terms, keeping the results on the history server.
+
+    No IDs are returned; the results are fetched through the returned WebEnv
+    and query key instead.
+    """
+    search_params = {
+        "db": DATABASE,
+        "term": " OR ".join(terms),
+        "retmode": "json",
+        "retmax": 0,
+        "usehistory": "y"
     }
 
+    if api_key:
+        search_params["api_key"] = api_key
+
+    search_response = await scheduler.request(
+        client, "POST", NCBI_ESEARCH_URL, api_key=api_key, data=search_params
+    )
+    search_response.raise_for_status()
+    search_data = search_response.json().get("esearchresult", {})
+
+    return HistorySearch(
+        count=int(search_data.get("count", 0)),
+        webenv=search_data.get("webenv", ""),
+        query_key=search_data.get("querykey", "")
+    )
+
+
+async def _fetch_chunk(
+    client: httpx.AsyncClient,
+    fetch_params: Dict[str, Any],
+    api_key: Optional[str],
+    semaphore: asyncio.Semaphore,
+    fields: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """Fetch a single EFetch page, parsing records while the body streams in."""
+    fetch_params = {"db": DATABASE, "retmode": "xml", **fetch_params}
+
     if api_key:
         fetch_params["api_key"] = api_key
 
-    fetch_response = await client.post(NCBI_EFETCH_URL, data=fetch_params)
-    fetch_response.raise_for_status()
+    parser = RecordStreamParser(fields)
+    records = []
+
+    async with semaphore:
+        async with scheduler.stream(
+            client, "POST", NCBI_EFETCH_URL, api_key=api_key, data=fetch_params
+        ) as fetch_response:
+            fetch_response.raise_for_status()
+            async for data in fetch_response.aiter_bytes():
+                records.extend(parser.feed(data))
+
+    records.extend(parser.close())
+    return records
+
+
+async def _fetch_pages(
+    client: httpx.AsyncClient,
+    pages: List[Dict[str, Any]],
+    api_key: Optional[str],
+    fields: Optional[List[str]],
+    max_concurrency: int
+) -> AsyncIterator[Tuple[int, List[Dict[str, Any]]]]:
+    """Fetch EFetch pages concurrently, yielding ``(index, records)`` as each completes."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(index: int, params: Dict[str, Any]):
+        return index, await _fetch_chunk(client, params, api_key, semaphore, fields)
+
+    async for result in _as_completed([fetch(i, params) for i, params in enumerate(pages)]):
+        yield result
+
+
+async def _as_completed(coroutines: List[Awaitable[Any]]) -> AsyncIterator[Any]:
+    """Run ``coroutines`` concurrently, yielding their results as they complete."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The consumer may stop early, e.g. when a streaming client disconnects
+        for task in tasks:
+            task.cancel()
+
+
+async def _summary_accessions(
+    client: httpx.AsyncClient,
+    ids: List[int],
+    api_key: Optional[str],
+    semaphore: asyncio.Semaphore
+) -> Dict[str, int]:
+    """Map the experiment accession of each of ``ids`` to its UID, as reported by ESummary."""
+    summary_params = {
+        "db": DATABASE,
+        "id": ",".join(map(str, ids)),
+        "retmode": "json"
+    }
+
+    if api_key:
+        summary_params["api_key"] = api_key
+
+    async with semaphore:
+        summary_response = await scheduler.request(
+            client, "POST", NCBI_ESUMMARY_URL, api_key=api_key, data=summary_params
+        )
+    summary_response.raise_for_status()
+    result = summary_response.json().get("result", {})
+
+    accessions = {}
+    for uid in result.get("uids", []):
+        match = _SUMMARY_ACCESSION.search(result.get(uid, {}).get("expxml", ""))
+        if match:
+            accessions[match.group(1)] = int(uid)
+    return accessions
+
+
+async def _iter_uid_records(
+    client: httpx.AsyncClient,
+    ids: List[int],
+    api_key: Optional[str],
+    fields: Optional[List[str]],
+    cache: Optional[MetadataCache],
+    chunk_size: int,
+    max_concurrency: int,
+    match: bool = True
+) -> AsyncIterator[List[Tuple[Optional[int], Dict[str, Any]]]]:
+    """
+    Fetch the records of ``ids`` batch by batch, paired with their UID.
+
+    Records are matched to the UID ESummary gives for their experiment
+    accession, never by their position in the EFetch response. Without
+    ``match`` or a cache, which stores records by UID, ESummary is skipped and
+    every UID is None.
+    """
+    projection = projection_key(fields)
+
+    cached = await run_in_threadpool(cache.get_many, ids, projection) if cache is not None else {}
+    if cached:
+        yield [(uid, cached[uid]) for uid in ids if uid in cached]
+
+    missing = [uid for uid in ids if uid not in cached]
+    chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+
+    match = match or cache is not None
+    if match and fields is not None and EXPERIMENT_ACCESSION_FIELD not in fields:
+        fields = [*fields, EXPERIMENT_ACCESSION_FIELD]
+    # ESummary requests take a slot of the EFetch concurrency limit as well
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(chunk: List[int]) -> List[Tuple[Optional[int], Dict[str, Any]]]:
+        records = await _fetch_chunk(client, {"id": ",".join(map(str, chunk))}, api_key, semaphore, fields)
+        if not match:
+            return [(None, record) for record in records]
+
+        try:
+            accessions = await _summary_accessions(client, chunk, api_key, semaphore)
+        except (httpx.HTTPError, ValueError):
+            accessions = {}
+        return [
+            (accessions.get(record.get(EXPERIMENT_ACCESSION_FIELD)), record)
+            for record in records
+        ]
+
+    async for matched in _as_completed([fetch(chunk) for chunk in chunks]):
+        if cache is not None:
+            await run_in_threadpool(
+                cache.put_many,
+                {uid: record for uid, record in matched if uid is not None},
+                projection
+            )
+        yield matched
+
+
+async def iter_metadata(
+    client: httpx.AsyncClient,
+    ids: List[int],
+    api_key: Optional[str] = None,
+    fields: Optional[Iterable[str]] = None,
+    cache: Optional[MetadataCache] = None,
+    chunk_size: int = EFETCH_CHUNK_SIZE,
+    max_concurrency: int = EFETCH_MAX_CONCURRENCY
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Same as :func:`fetch_metadata`, but yields the records batch by batch.
+
+    Cached records come first, then every EFetch batch as soon as it is parsed,
+    in completion order rather than in the order of ``ids``.
+    """
+    fields = list(fields) if fields is not None else None
+    async for batch in _iter_uid_records(
+        client, ids, api_key, fields, cache, chunk_size, max_concurrency, match=False
+    ):
+        yield [record for _, record in batch]
+
+
+async def fetch_metadata(
+    client: httpx.AsyncClient,
+    ids: List[int],
+    api_key: Optional[str] = None,
+    fields: Optional[Iterable[str]] = None,
+    cache: Optional[MetadataCache] = None,
+    chunk_size: int = EFETCH_CHUNK_SIZE,
+    max_concurrency: int = EFETCH_MAX_CONCURRENCY
+) -> pd.DataFrame:
+    """
+    Fetch metadata for the given IDs from NCBI.
+
+    IDs are split into batches of ``chunk_size`` and up to ``max_concurrency``
+    batches are requested at once. Each batch is parsed while it streams in,
+    and the records are returned in the order of ``ids``.
+
+    When ``fields`` are given, only those column paths are extracted from the
+    XML; otherwise every flattened field becomes a column.
+
+    With a ``cache``, only the IDs missing from it are sent to EFetch and the
+    fetched records are stored in it.
+    """
+    fields = list(fields) if fields is not None else None
+
+    by_uid = {}
+    unmatched = []
+    async for batch in _iter_uid_records(
+        client, ids, api_key, fields, cache, chunk_size, max_concurrency
+    ):
+        for uid, record in batch:
+            if uid is None:
+                unmatched.append(record)
+            else:
+                by_uid[uid] = record
+
+    table = RecordTable(fields)
+    table.extend(by_uid[uid] for uid in ids if uid in by_uid)
+    table.extend(unmatched)
+
+    return table.to_frame()
+
+
+def _history_pages(history: HistorySearch, max_results: int, chunk_size: int) -> List[Dict[str, Any]]:
+    total = min(history.count, max_results)
+    return [
+        {
+            "WebEnv": history.webenv,
+            "query_key": history.query_key,
+            "retstart": start,
+            "retmax": min(chunk_size, total - start)
+        }
+        for start in range(0, total, chunk_size)
+    ]
+
+
+async def iter_history_metadata(
+    client: httpx.AsyncClient,
+    history: HistorySearch,
+    max_results: int,
+    api_key: Optional[str] = None,
+    fields: Optional[Iterable[str]] = None,
+    chunk_size: int = EFETCH_CHUNK_SIZE,
+    max_concurrency: int = EFETCH_MAX_CONCURRENCY
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Same as :func:`fetch_history_metadata`, but yields each page as soon as it is parsed."""
+    fields = list(fields) if fields is not None else None
+    pages = _history_pages(history, max_results, chunk_size)
+
+    async for _, records in _fetch_pages(client, pages, api_key, fields, max_concurrency):
+        yield records
+
+
+async def fetch_history_metadata(
+    client: httpx.AsyncClient,
+    history: HistorySearch,
+    max_results: int,
+    api_key: Optional[str] = None,
+    fields: Optional[Iterable[str]] = None,
+    chunk_size: int = EFETCH_CHUNK_SIZE,
+    max_concurrency: int = EFETCH_MAX_CONCURRENCY
+) -> pd.DataFrame:
+    """
+    Fetch metadata for the first ``max_results`` results of a history search.
+
+    Pages of ``chunk_size`` records are requested by ``retstart``/``retmax``
+    through the WebEnv, up to ``max_concurrency`` at once, so the ID list never
+    leaves the history server. Records are returned in search order.
+    """
+    fields = list(fields) if fields is not None else None
+    pages = _history_pages(history, max_results, chunk_size)
 
-    # Parse XML
-    root = ElementTree.fromstring(fetch_response.text)
-    records = root.findall("./*")
+    results = {}
+    async for index, records in _fetch_pages(client, pages, api_key, fields, max_concurrency):
+        results[index] = records
 
-    dataframes = []
-    for record in records:
-        record_dict = {}
-        for child in record.findall("./*"):
-            record_dict.update(xmltodict.parse(
-                ElementTree.tostring(child), process_namespaces=True
-            ))
-        dataframes.append(pd.json_normalize(record_dict))
+    table = RecordTable(fields)
+    for index in range(len(pages)):
+        table.extend(results[index])
 
-    return pd.concat(dataframes) if dataframes else pd.DataFrame()
+    return table.to_frame()
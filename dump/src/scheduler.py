@@ -0,0 +1,174 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import random
+import struct
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from config import (
+    NCBI_RATE_LIMIT,
+    NCBI_RATE_LIMIT_WITH_KEY,
+    NCBI_RATE_BURST,
+    NCBI_RATE_LIMIT_DIR,
+    NCBI_MAX_RETRIES,
+    NCBI_BACKOFF_BASE,
+    NCBI_BACKOFF_MAX,
+)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Bucket state on disk: available tokens and the time they were computed at
+_STATE = struct.Struct("dd")
+
+
+class TokenBucket:
+    """
+    Token bucket whose state lives in a small file guarded by ``flock``.
+
+    Every gunicorn worker opens the same file, so the request rate is enforced
+    across the whole service rather than per process.
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float = 1.0):
+        self.path = path
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+
+    def _try_acquire(self) -> float:
+        """Take a token if one is available, otherwise return the seconds to wait."""
+        # The file is opened on every call: flock locks are shared between
+        # processes forked from the same descriptor (gunicorn --preload).
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            raw = os.pread(fd, _STATE.size, 0)
+            if len(raw) == _STATE.size:
+                tokens, updated = _STATE.unpack(raw)
+                tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            else:
+                tokens = self.capacity
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            os.pwrite(fd, _STATE.pack(tokens, now), 0)
+            return wait
+        finally:
+            os.close(fd)
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def get_bucket(api_key: Optional[str] = None) -> TokenBucket:
+    """Return the shared bucket for an API key (requests without a key share one bucket)."""
+    name = hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else "anonymous"
+    if name not in _buckets:
+        os.makedirs(NCBI_RATE_LIMIT_DIR, exist_ok=True)
+        _buckets[name] = TokenBucket(
+            os.path.join(NCBI_RATE_LIMIT_DIR, f"{name}.bucket"),
+            rate=NCBI_RATE_LIMIT_WITH_KEY if api_key else NCBI_RATE_LIMIT,
+            capacity=NCBI_RATE_BURST
+        )
+    return _buckets[name]
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(NCBI_BACKOFF_MAX, NCBI_BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Parse the ``Retry-After`` header (delta-seconds or HTTP date)."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    api_key: Optional[str],
+    stream: bool,
+    **kwargs
+) -> httpx.Response:
+    bucket = get_bucket(api_key)
+
+    for attempt in range(NCBI_MAX_RETRIES + 1):
+        await bucket.acquire()
+        try:
+            response = await client.send(
+                client.build_request(method, url, **kwargs), stream=stream
+            )
+        except httpx.TransportError:
+            if attempt == NCBI_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            continue
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt == NCBI_MAX_RETRIES:
+            return response
+
+        delay = _retry_after(response)
+        await response.aclose()
+        await asyncio.sleep(delay if delay is not None else _backoff(attempt))
+
+
+async def request(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    api_key: Optional[str] = None,
+    **kwargs
+) -> httpx.Response:
+    """
+    Send a request to E-utilities within the rate limit of ``api_key``.
+
+    429 and 5xx responses as well as transport errors are retried with jittered
+    exponential backoff, honoring ``Retry-After`` when NCBI sends it. The last
+    response is returned as is, so callers still call ``raise_for_status``.
+    """
+    return await _send(client, method, url, api_key, stream=False, **kwargs)
+
+
+@asynccontextmanager
+async def stream(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    api_key: Optional[str] = None,
+    **kwargs
+) -> AsyncIterator[httpx.Response]:
+    """Same as :func:`request`, but yields a response whose body is read lazily."""
+    response = await _send(client, method, url, api_key, stream=True, **kwargs)
+    try:
+        yield response
+    finally:
+        await response.aclose()
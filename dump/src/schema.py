@@ -1,6 +1,15 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
+
+# Results allowed per request when IDs are exchanged with the client
+MAX_RESULTS = 1000
+# Results allowed per request when paging through the history server
+MAX_HISTORY_RESULTS = 100_000
+
+# Row layouts: one row per experiment package, one row per run, or one row per
+# package with its runs nested
+Layout = Literal["experiment", "run", "nested"]
 
 
 class EzMetaFetchRequest(BaseModel):
@@ -17,9 +26,42 @@ class EzMetaFetchRequest(BaseModel):
     )
 
     max_results: int = Field(
-        gt=0, le=1000,
+        gt=0, le=MAX_HISTORY_RESULTS,
         default=100,
-        description="Maximum number of results to return"
+        description=(
+            f"Maximum number of results to return (up to {MAX_RESULTS}, "
+            f"or {MAX_HISTORY_RESULTS} with use_history)"
+        )
+    )
+    use_history: bool = Field(
+        default=False,
+        description=(
+            "Keep search results on the NCBI history server and page through them "
+            "instead of exchanging ID lists. Requires terms; ids are not returned."
+        )
+    )
+
+    fields: Optional[List[str]] = Field(
+        default=None,
+        description=(
+            "Extra flattened XML paths to return along with the common columns, "
+            "e.g. SAMPLE.SAMPLE_ATTRIBUTES.SAMPLE_ATTRIBUTE"
+        )
+    )
+    layout: Layout = Field(
+        default="experiment",
+        description=(
+            "Row layout: one row per experiment package, one row per run ('run'), "
+            "or one row per package with its runs in a 'Runs' column ('nested')"
+        )
+    )
+
+    stream: bool = Field(
+        default=False,
+        description=(
+            "Stream renamed records as NDJSON as soon as each batch is parsed "
+            "(same as sending Accept: application/x-ndjson)"
+        )
     )
 
     # HTTP configuration
@@ -28,6 +70,12 @@ class EzMetaFetchRequest(BaseModel):
         description="NCBI API key for higher request rate limits"
     )
 
+    @model_validator(mode="after")
+    def check_max_results(self):
+        if not self.use_history and self.max_results > MAX_RESULTS:
+            raise ValueError(f"max_results above {MAX_RESULTS} requires use_history")
+        return self
+
     class Config:
         schema_extra = {
             "example": {
@@ -60,3 +108,72 @@ class EzMetaFetchResponse(BaseModel):
         default=None,
         description="Additional information about the request"
     )
+
+
+class EzMetaJobRequest(BaseModel):
+    """Schema for bulk fetch jobs run in the background"""
+
+    terms: Optional[List[str]] = Field(
+        default=None,
+        description="List of search terms to query the database"
+    )
+    ids: Optional[List[int]] = Field(
+        default=None,
+        description="List of specific IDs to fetch metadata for"
+    )
+    max_results: int = Field(
+        gt=0, le=MAX_HISTORY_RESULTS,
+        default=10_000,
+        description="Maximum number of results to fetch"
+    )
+    fields: Optional[List[str]] = Field(
+        default=None,
+        description="Extra flattened XML paths to return along with the common columns"
+    )
+    layout: Layout = Field(
+        default="experiment",
+        description=(
+            "Row layout: one row per experiment package, one row per run ('run'), "
+            "or one row per package with its runs in a 'Runs' column ('nested')"
+        )
+    )
+    api_key: Optional[str] = Field(
+        default=None,
+        description="NCBI API key for higher request rate limits"
+    )
+
+
+class EzMetaJobStatus(BaseModel):
+    """Progress of a bulk fetch job"""
+    job_id: str = Field(
+        description="Job identifier"
+    )
+    state: str = Field(
+        description="Job state (pending/running/completed/failed)"
+    )
+    total_ids: Optional[int] = Field(
+        default=None,
+        description="Number of IDs to fetch, known once the search is done"
+    )
+    chunks_total: Optional[int] = Field(
+        default=None,
+        description="Number of chunks the IDs are fetched in"
+    )
+    chunks_done: int = Field(
+        default=0,
+        description="Number of chunks fetched and written to the results"
+    )
+    records: int = Field(
+        default=0,
+        description="Number of records written so far"
+    )
+    created: float = Field(
+        description="Creation time (UNIX timestamp)"
+    )
+    updated: float = Field(
+        description="Last update time (UNIX timestamp)"
+    )
+    error: Optional[str] = Field(
+        default=None,
+        description="Error message of a failed job"
+    )
@@ -0,0 +1,50 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+
+class RecordTable:
+    """
+    Columnar accumulator for flat records.
+
+    Values are appended to one list per column and a single DataFrame is built
+    at the end, instead of concatenating one single-row DataFrame per record.
+    When ``columns`` is given, only those columns are collected and all other
+    keys are ignored.
+    """
+
+    def __init__(self, columns: Optional[Iterable[str]] = None):
+        self._fixed = columns is not None
+        self._columns: Dict[str, List[Any]] = {column: [] for column in columns or []}
+        self._seen = set()
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, record: Dict[str, Any]):
+        """Add a record, filling the columns it lacks with ``None``."""
+        for key, value in record.items():
+            column = self._columns.get(key)
+            if column is None:
+                if self._fixed:
+                    continue
+                column = self._columns[key] = [None] * self._length
+            column.append(value)
+            self._seen.add(key)
+
+        self._length += 1
+        for column in self._columns.values():
+            if len(column) < self._length:
+                column.append(None)
+
+    def extend(self, records: Iterable[Dict[str, Any]]):
+        for record in records:
+            self.append(record)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Build the DataFrame, leaving out columns no record had."""
+        return pd.DataFrame(
+            {key: values for key, values in self._columns.items() if key in self._seen},
+            index=pd.RangeIndex(self._length)
+        )
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+import cache as cache_module
+from cache import SharedTTLCache, TTLCache
+
+
+def test_ttl_cache_expires_entries():
+    async def run():
+        cache = TTLCache(ttl=0, max_entries=10)
+        await cache.set("key", [1, 2])
+        return await cache.get("key")
+
+    assert asyncio.run(run()) is None
+
+
+def test_shared_cache_is_shared_by_workers(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+
+    async def run():
+        writer = SharedTTLCache(path, ttl=60, max_entries=10)
+        reader = SharedTTLCache(path, ttl=60, max_entries=10)
+        await writer.set(("esearch", ("a", "b"), 5), [1, 2, 3])
+        try:
+            return await reader.get(("esearch", ("a", "b"), 5)), await reader.get("missing")
+        finally:
+            writer.close()
+            reader.close()
+
+    assert asyncio.run(run()) == ([1, 2, 3], None)
+
+
+def test_shared_cache_queries_off_the_event_loop(tmp_path, monkeypatch):
+    cache = SharedTTLCache(str(tmp_path / "cache.sqlite3"), ttl=60, max_entries=10)
+    threads = []
+    for name in ("_select", "_insert"):
+        method = getattr(cache, name)
+
+        def record(*args, method=method):
+            threads.append(threading.current_thread())
+            return method(*args)
+        monkeypatch.setattr(cache, name, record)
+
+    async def run():
+        await cache.set("key", "value")
+        cache._entries.clear()
+        return await cache.get("key")
+
+    try:
+        assert asyncio.run(run()) == "value"
+    finally:
+        cache.close()
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+def test_shared_cache_sweeps_expired_entries_periodically(tmp_path, monkeypatch):
+    cache = SharedTTLCache(str(tmp_path / "cache.sqlite3"), ttl=20, max_entries=10)
+    clock = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: clock[0])
+
+    def stored():
+        with cache._database.lock:
+            return [key for key, in cache._database.connection.execute("SELECT key FROM searches")]
+
+    async def run():
+        # Expired while the sweep waits for its interval
+        await cache.set("old", 1)
+        clock[0] += 30
+        await cache.set("new", 2)
+        swept_early = stored()
+        clock[0] += cache_module._EVICT_INTERVAL
+        await cache.set("newer", 3)
+        return swept_early, stored()
+
+    try:
+        swept_early, swept = asyncio.run(run())
+    finally:
+        cache.close()
+    assert sorted(swept_early) == ['"new"', '"old"']
+    assert sorted(swept) == ['"newer"']
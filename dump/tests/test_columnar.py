@@ -0,0 +1,39 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from columnar import ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE, to_columnar
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+TITLES = [
+    "GATA1 knockdown in HeLa cells",
+    {"@xml:lang": "en", "#text": "Mouse liver genomes"},
+    None,
+    '"Quoted" title',
+    ["first", "second"],
+]
+
+
+def read_table(data: bytes, media_type: str):
+    if media_type == ARROW_MEDIA_TYPE:
+        return pa.ipc.open_stream(data).read_all()
+    return pq.read_table(io.BytesIO(data))
+
+
+@pytest.mark.parametrize("media_type", [ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE])
+def test_mixed_column_keeps_strings_unchanged(media_type):
+    df = pd.DataFrame({"Study Title": TITLES, "Taxon ID": ["9606", "10090", None, "9606", "9606"]})
+
+    table = read_table(to_columnar(df, media_type), media_type)
+    titles = table.column("Study Title").to_pylist()
+
+    assert titles[0] == "GATA1 knockdown in HeLa cells"
+    assert json.loads(titles[1]) == {"@xml:lang": "en", "#text": "Mouse liver genomes"}
+    assert titles[2] is None
+    assert titles[3] == '"Quoted" title'
+    assert json.loads(titles[4]) == ["first", "second"]
+    assert table.column("Taxon ID").to_pylist() == ["9606", "10090", None, "9606", "9606"]
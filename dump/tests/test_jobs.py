@@ -0,0 +1,81 @@
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+import jobs as jobs_module
+from jobs import COMPLETED, FAILED, RUNNING, JobManager
+
+
+def add_job(manager, state, updated):
+    """Write the manifest of a job as a previous run left it."""
+    job_id = os.urandom(16).hex()
+    os.makedirs(manager._path(job_id))
+    manifest = {"job_id": job_id, "state": state, "chunks_done": [], "updated": updated}
+    manager._write_manifest_content(job_id, json.dumps(manifest))
+    return job_id
+
+
+def test_prune_deletes_expired_finished_jobs(tmp_path):
+    manager = JobManager(str(tmp_path), client=None, ttl=3600)
+    old = time.time() - 7200
+    add_job(manager, COMPLETED, old)
+    add_job(manager, FAILED, old)
+    kept = [add_job(manager, COMPLETED, time.time()), add_job(manager, RUNNING, old)]
+
+    manager.prune()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(kept)
+
+
+def test_delete_job(tmp_path):
+    manager = JobManager(str(tmp_path), client=None)
+    job_id = add_job(manager, COMPLETED, time.time())
+
+    assert asyncio.run(manager.delete(job_id)) is True
+    assert os.listdir(tmp_path) == []
+    assert asyncio.run(manager.delete(job_id)) is None
+    assert asyncio.run(manager.delete("zzz")) is None
+
+
+def test_delete_keeps_job_run_by_another_worker(tmp_path):
+    manager = JobManager(str(tmp_path), client=None)
+    job_id = add_job(manager, RUNNING, time.time())
+
+    fd = os.open(os.path.join(manager._path(job_id), "lock"), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert asyncio.run(manager.delete(job_id)) is False
+        assert os.listdir(tmp_path) == [job_id]
+    finally:
+        os.close(fd)
+
+
+def test_chunks_are_written_off_the_event_loop(tmp_path, monkeypatch):
+    async def fetch_metadata(client, ids, api_key, fields=None, cache=None):
+        return pd.DataFrame({"id": ids})
+
+    threads = []
+
+    def rename(data, fields, layout):
+        threads.append(threading.current_thread())
+        return data
+
+    monkeypatch.setattr(jobs_module, "fetch_metadata", fetch_metadata)
+    monkeypatch.setattr(jobs_module, "select_and_rename_common_columns", rename)
+
+    async def run():
+        manager = JobManager(str(tmp_path), client=None, chunk_size=2)
+        job_id = manager.create(jobs_module.EzMetaJobRequest(ids=[1, 2, 3, 4, 5])).job_id
+        await manager._tasks[job_id]
+        return manager.status(job_id), b"".join(manager.iter_results(job_id))
+
+    status, results = asyncio.run(run())
+
+    assert (status.state, status.chunks_done, status.records) == (COMPLETED, 3, 5)
+    assert [json.loads(line)["id"] for line in results.splitlines()] == [1, 2, 3, 4, 5]
+    assert len(threads) == 3 and threading.main_thread() not in threads
@@ -0,0 +1,65 @@
+"""
+The streaming parser must produce the records the service built before it,
+with ``pd.json_normalize`` over ``xmltodict.parse`` of each part of a record.
+"""
+import os
+from typing import Any, Dict, List
+from xml.etree import ElementTree
+
+import pandas as pd
+import pytest
+
+from parser import SRA_FILES_FIELD, RecordStreamParser, flatten_record
+
+xmltodict = pytest.importorskip("xmltodict")
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "experiment_packages.xml")
+
+
+@pytest.fixture(scope="module")
+def document() -> bytes:
+    with open(FIXTURE, "rb") as f:
+        return f.read()
+
+
+def normalized_records(document: bytes) -> List[Dict[str, Any]]:
+    """Flatten every record the way the service did with xmltodict and json_normalize."""
+    records = []
+    for record in ElementTree.fromstring(document).findall("./*"):
+        record_dict: Dict[str, Any] = {}
+        for child in record.findall("./*"):
+            record_dict.update(xmltodict.parse(
+                ElementTree.tostring(child), process_namespaces=True
+            ))
+        records.append(pd.json_normalize(record_dict).to_dict("records")[0])
+    return records
+
+
+def without_sra_files(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in row.items() if key != SRA_FILES_FIELD}
+
+
+def test_flatten_record_matches_json_normalize(document):
+    expected = normalized_records(document)
+    rows = [
+        without_sra_files(flatten_record(record))
+        for record in ElementTree.fromstring(document)
+    ]
+
+    assert len(rows) == len(expected) == 2
+    for row, record in zip(rows, expected):
+        assert row == record
+        assert list(row) == list(record)
+
+
+@pytest.mark.parametrize("piece_size", [1, 64, 4096])
+def test_stream_parser_matches_json_normalize(document, piece_size):
+    parser = RecordStreamParser()
+    rows = []
+    for start in range(0, len(document), piece_size):
+        rows.extend(parser.feed(document[start:start + piece_size]))
+    rows.extend(parser.close())
+
+    assert [without_sra_files(row) for row in rows] == normalized_records(document)
+    assert [len(row[SRA_FILES_FIELD]) for row in rows] == [2, 2]
+    assert [len(sra_file["Alternatives"]) for sra_file in rows[0][SRA_FILES_FIELD]] == [1, 2]
@@ -0,0 +1,35 @@
+import asyncio
+import os
+from urllib.parse import parse_qs
+
+import httpx
+
+from requests import fetch_metadata
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "experiment_packages.xml")
+# UIDs of the packages of the fixture, which are listed in the opposite order
+ACCESSIONS = {"2": "SRX2112344", "1": "SRX5541890"}
+
+
+def ncbi_transport():
+    with open(FIXTURE, "rb") as file:
+        packages = file.read()
+
+    def handler(request: httpx.Request):
+        params = {key: value[0] for key, value in parse_qs(request.content.decode()).items()}
+        if request.url.path.endswith("efetch.fcgi"):
+            return httpx.Response(200, content=packages)
+        uids = params["id"].split(",")
+        result = {uid: {"expxml": f'<Experiment acc="{ACCESSIONS[uid]}" ver="1"/>'} for uid in uids}
+        return httpx.Response(200, json={"result": {"uids": uids, **result}})
+
+    return httpx.MockTransport(handler)
+
+
+def test_records_are_matched_to_uids_by_accession():
+    async def run():
+        async with httpx.AsyncClient(transport=ncbi_transport()) as client:
+            return await fetch_metadata(client, [2, 1], fields=["EXPERIMENT.@accession"])
+
+    data = asyncio.run(run())
+    assert data["EXPERIMENT.@accession"].tolist() == ["SRX2112344", "SRX5541890"]
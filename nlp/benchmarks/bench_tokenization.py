@@ -0,0 +1,69 @@
+"""
+Compare the blank spaCy pipeline with the stanza pipeline, called once per text
+and in bulk, on a corpus of metadata strings.
+
+Run from the repository root:
+
+    python nlp/benchmarks/bench_tokenization.py
+
+The stanza rows are skipped when stanza or its English resources are not
+installed.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from tokenization import SpacyTokenizer, StanzaTokenizer
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "metadata.txt")
+
+
+def load_texts():
+    with open(FIXTURE) as file:
+        return [line.rstrip("\n") for line in file if line.strip()]
+
+
+def per_call(tokenizer, texts):
+    return [tokenizer.tokenize(text) for text in texts]
+
+
+def load_stanza():
+    try:
+        return StanzaTokenizer()
+    except Exception as e:
+        print(f"stanza unavailable, skipping: {e}")
+        return None
+
+
+def main():
+    texts = load_texts()
+    spacy = SpacyTokenizer()
+    stanza = load_stanza()
+
+    runs = [
+        ("spacy", lambda: per_call(spacy, texts), 20),
+        ("spacy bulk", lambda: spacy.tokenize_many(texts), 20),
+    ]
+    if stanza is not None:
+        runs.append(("stanza", lambda: per_call(stanza, texts), 3))
+        runs.append(("stanza bulk", lambda: stanza.tokenize_many(texts), 3))
+
+    print(f"{len(texts)} texts")
+    print(f"{'backend':>12} {'total':>10} {'texts/s':>10}")
+    for name, run, repeat in runs:
+        elapsed = timeit.timeit(run, number=repeat) / repeat
+        print(f"{name:>12} {elapsed * 1000:>8.1f}ms {len(texts) / elapsed:>10.0f}")
+
+    if stanza is not None:
+        expected = stanza.tokenize_many(texts)
+        actual = spacy.tokenize_many(texts)
+        different = [text for text, a, b in zip(texts, actual, expected) if a != b]
+        print(f"spacy output differs from stanza on {len(different)}/{len(texts)} texts")
+        for text in different:
+            print(f"  {text}")
+
+
+if __name__ == "__main__":
+    main()
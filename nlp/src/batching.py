@@ -0,0 +1,133 @@
+from __future__ import annotations
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from hugface import split_by_text
+
+
+class Overloaded(Exception):
+    """Raised when too many requests are already waiting for the model."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many requests are waiting for the model")
+        self.retry_after = retry_after
+
+
+class MicroBatcher:
+    """
+    Collects the sentences of concurrent requests into shared predict batches.
+
+    Requests queue their tokenized sentences and wait on a future. A worker
+    takes the oldest request, keeps taking queued requests until
+    ``max_batch_size`` sentences are gathered or ``max_delay`` seconds have
+    passed, labels all of them with one ``model.predict`` call and resolves
+    every request with the labels of its own sentences.
+
+    Tokenization and prediction run on a dedicated thread pool of
+    ``max_concurrency`` threads, one per worker, so the event loop stays free
+    to answer other requests. At most ``max_queue_size`` requests wait at once;
+    later ones are rejected with :class:`Overloaded`.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: int = 64,
+        max_delay: float = 0.01,
+        max_concurrency: int = 1,
+        max_queue_size: int = 64,
+        retry_after: int = 1
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Future] = []
+        self._pending = 0
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="inference"
+        )
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.ensure_future(self._run()) for _ in range(self.max_concurrency)]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def process(self, texts: List[str]) -> List[list]:
+        """Tokenize and label texts, returning the labeled sentences of each text."""
+        if self._pending >= self.max_queue_size:
+            raise Overloaded(self.retry_after)
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_event_loop()
+            tokenized = await loop.run_in_executor(
+                self._executor, self.model.tokenize_many, texts
+            )
+            labeled = await self.submit(list(itertools.chain.from_iterable(tokenized)))
+            return split_by_text(labeled, tokenized)
+        finally:
+            self._pending -= 1
+
+    async def submit(self, sentences: List[List[str]]) -> List[list]:
+        """Label tokenized sentences along with those of other pending requests."""
+        if not sentences:
+            return []
+
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((sentences, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+
+            deadline = loop.time() + self.max_delay
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            await self._process(batch)
+
+    async def _process(self, batch: List[Tuple[List[List[str]], asyncio.Future]]):
+        sentences = list(itertools.chain.from_iterable(item for item, _ in batch))
+        try:
+            labeled = await asyncio.get_event_loop().run_in_executor(
+                self._executor, self.model.predict, sentences
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        start = 0
+        for item, future in batch:
+            # Requests whose client went away are cancelled already
+            if not future.done():
+                future.set_result(labeled[start:start + len(item)])
+            start += len(item)
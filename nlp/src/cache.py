@@ -0,0 +1,208 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from hugface import LabeledSentence
+
+# SQLite limits the number of bound parameters per statement
+_BATCH = 500
+
+# Share of disk_max_entries evicted at once, so that eviction is rare
+_EVICT_FRACTION = 0.1
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+"""
+
+
+def model_version(config) -> str:
+    """Identify the model results are cached for: its ``version`` or a hash of its configuration."""
+    aioner = config["models"]["aioner"]
+    if aioner.get("version"):
+        return str(aioner["version"])
+    return hashlib.sha1(json.dumps(aioner, sort_keys=True).encode()).hexdigest()
+
+
+def _dump(output: List[LabeledSentence]) -> str:
+    return json.dumps([
+        [sentence.tokens, sentence.words.tolist(), sentence.labels.tolist()]
+        for sentence in output
+    ])
+
+
+def _load(value: str) -> List[LabeledSentence]:
+    return [
+        LabeledSentence(tokens, np.array(words, dtype=np.int64), np.array(labels, dtype=np.int64))
+        for tokens, words, labels in json.loads(value)
+    ]
+
+
+class ResultCache:
+    """
+    Cache of the labeled sentences of texts, keyed by a hash of the text, the
+    model type and the model version.
+
+    Up to ``max_entries`` results are kept in memory, evicted least recently
+    used first. With a ``path``, results are also stored in a SQLite database
+    on local disk, which keeps up to ``disk_max_entries`` of them across
+    restarts.
+
+    The database is only used from a thread of its own, so the event loop
+    never waits for the disk. Rows are counted in memory, and once there are
+    more than ``disk_max_entries`` the least recently used tenth of them is
+    evicted at once.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        max_entries: int = 10000,
+        path: Optional[str] = None,
+        disk_max_entries: int = 1000000
+    ):
+        self.version = version
+        self.max_entries = max_entries
+        self.path = path
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, List[LabeledSentence]]" = OrderedDict()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._disk_entries = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache") if path else None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            (self._disk_entries,), = connection.execute("SELECT COUNT(*) FROM results")
+            self._connection = connection
+        return self._connection
+
+    def key(self, text: str, model_type: str) -> str:
+        return hashlib.sha256(json.dumps([model_type, self.version, text]).encode()).hexdigest()
+
+    async def get_many(self, keys: List[str]) -> Dict[str, List[LabeledSentence]]:
+        """Return the cached results among ``keys``."""
+        found = {}
+        for key in keys:
+            output = self._entries.get(key)
+            if output is not None:
+                self._entries.move_to_end(key)
+                found[key] = output
+
+        missing = [key for key in keys if key not in found]
+        if self.path and missing:
+            stored = await self._run(self._get_stored, missing)
+            self._store(stored)
+            found.update(stored)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def put_many(self, results: Dict[str, List[LabeledSentence]]):
+        """Store results, evicting the least recently used ones."""
+        if not results:
+            return
+
+        # Labels are slices of the arrays of a whole batch, which must not be kept alive
+        results = {
+            key: [LabeledSentence(sentence.tokens, sentence.words.copy(), sentence.labels.copy()) for sentence in output]
+            for key, output in results.items()
+        }
+        self._store(results)
+        if self.path:
+            await self._run(self._put_stored, results)
+
+    async def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and the number of results cached in memory and on disk."""
+        stats = {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+        if self.path:
+            stats["disk_entries"] = await self._run(self._count_stored)
+        return stats
+
+    async def close(self):
+        if self._executor is not None:
+            await self._run(self._close_connection)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _run(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+
+    def _get_stored(self, keys: List[str]) -> Dict[str, List[LabeledSentence]]:
+        stored = {}
+        for i in range(0, len(keys), _BATCH):
+            batch = keys[i:i + _BATCH]
+            rows = self.connection.execute(
+                f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            stored.update((key, _load(value)) for key, value in rows)
+
+        if stored:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE results SET accessed = ? WHERE key = ?",
+                    [(time.time(), key) for key in stored]
+                )
+        return stored
+
+    def _put_stored(self, results: Dict[str, List[LabeledSentence]]):
+        now = time.time()
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?)",
+                [(key, _dump(output), now) for key, output in results.items()]
+            )
+            self._disk_entries += self.connection.total_changes - before
+
+            # Other workers may share the database, so rows are counted
+            # again before evicting any
+            if self._disk_entries > self.disk_max_entries and self._count_stored() > self.disk_max_entries:
+                evicted = self._disk_entries - int(self.disk_max_entries * (1 - _EVICT_FRACTION))
+                self.connection.execute(
+                    "DELETE FROM results WHERE rowid IN "
+                    "(SELECT rowid FROM results ORDER BY accessed LIMIT ?)",
+                    [evicted]
+                )
+                self._disk_entries -= evicted
+
+    def _count_stored(self) -> int:
+        (count,), = self.connection.execute("SELECT COUNT(*) FROM results")
+        self._disk_entries = count
+        return count
+
+    def _store(self, results: Dict[str, List[LabeledSentence]]):
+        for key, output in results.items():
+            self._entries[key] = output
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,41 @@
+"""
+Export the AIONER model configured in config.yaml as an inference-only SavedModel.
+
+    CONFIG_FILE=instance/config.yaml python src/export.py [output_dir]
+
+The output directory defaults to ``models.aioner.saved_model``. The service
+loads it at startup instead of rebuilding the Keras model from the PyTorch
+checkpoint and the .h5 weights. Export again after changing ``length_buckets``
+or ``jit_compile``, which are baked into the SavedModel.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.environ.get('APP_DIR', ''))
+
+from main import load_config, build_aioner_model
+
+
+def main():
+    config = load_config()
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "output_dir",
+        nargs="?",
+        default=config["models"]["aioner"].get("saved_model"),
+        help="Directory to write the SavedModel to"
+    )
+    args = parser.parse_args()
+    if not args.output_dir:
+        parser.error("output_dir is required when models.aioner.saved_model is not set")
+
+    model = build_aioner_model(config)
+    model.export(args.output_dir)
+    print(f"Exported AIONER model to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,11 @@ sys.path.insert(0, os.environ.get('APP_DIR', ''))
 
 import itertools
 from pathlib import Path
-import re
+from typing import Dict, List, Tuple
 from enum import Enum
 from collections import defaultdict, namedtuple
 
 import numpy as np
-import stanza
 import tensorflow as tf
 from transformers import TFAutoModel # type: ignore
 from transformers.models.auto.tokenization_auto import AutoTokenizer
@@ -20,19 +19,9 @@ from tensorflow.keras.layers import Input, TimeDistributed, Dropout, Dense
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.optimizers.schedules import LearningRateSchedule
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 
 from tf_crf2 import CRF
-
-
-def extract_lemma(word):
-    try:
-        if word.lemma is not None and len(str(word.lemma)) > 0:
-            return str(word.lemma)
-        else:
-            raise KeyError
-    except:
-        return str(word.text)
+from tokenization import create_tokenizer, token_offsets
 
 
 class ModelType(Enum):
@@ -75,7 +64,64 @@ class AioLabel(Enum):
             return ""
 
 
-WordMap = namedtuple("WordMap", ["token", "index"])
+# Entity and BIO type of every label id, so labels are decoded as integers
+ENTITY_NAMES = [label.label_name for label in AioLabel if label.label_type == "B"]
+BIO_TYPES = {"": 0, "O": 1, "B": 2, "I": 3}
+LABEL_ENTITIES = np.array([
+    ENTITY_NAMES.index(label.label_name) if label != AioLabel.UNDEFINED else -1
+    for label in AioLabel
+])
+LABEL_TYPES = np.array([BIO_TYPES[label.label_type] for label in AioLabel])
+
+class LabeledSentence(namedtuple("LabeledSentence", ["tokens", "words", "labels"])):
+    """Tokens of a sentence, and the indexes and label ids of its labeled words."""
+
+    def labeled_tokens(self) -> List[str]:
+        return [self.tokens[word] for word in self.words]
+
+
+def concatenate_labels(output: List[LabeledSentence]) -> np.ndarray:
+    return np.concatenate([sentence.labels for sentence in output] + [np.zeros(0, dtype=np.int64)])
+
+
+def entity_spans(labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the entities of a sequence of label ids.
+
+    An entity starts at a B label, or at an I label that does not continue the
+    entity before it, and goes on through I labels of the same entity type;
+    any other label ends it. Returns the first and last label index and the
+    entity index of each entity.
+    """
+    types = LABEL_TYPES[labels]
+    entities = LABEL_ENTITIES[labels]
+    inside = types >= BIO_TYPES["B"]
+
+    continues = np.zeros(len(labels), dtype=bool)
+    continues[1:] = (types[1:] == BIO_TYPES["I"]) & inside[:-1] & (entities[1:] == entities[:-1])
+
+    first = np.flatnonzero(inside & ~continues)
+    last = np.flatnonzero(inside & ~np.append(continues[1:], False))
+    return first, last, entities[first]
+
+
+# First subword tokens of the words of a batch, sorted by sentence: sentence
+# and word indexes, the window row and position their label is read from,
+# and where each sentence starts
+WordStarts = namedtuple("WordStarts", ["sentences", "words", "rows", "positions", "offsets"])
+
+# Sequence lengths sentences are padded to; each batch is padded to the
+# smallest bucket holding its sentences instead of the maximum length
+LENGTH_BUCKETS = (32, 64, 128, 256)
+
+
+def split_by_text(labeled: list, tokenized: list) -> list:
+    """Split the labels of the sentences of several texts back into one list per text."""
+    output, start = [], 0
+    for sentences in tokenized:
+        output.append(labeled[start:start + len(sentences)])
+        start += len(sentences)
+    return output
 
 
 class LRSchedule_LINEAR(LearningRateSchedule):
@@ -111,7 +157,12 @@ class HugFace_Model():
         self,
         checkpoint_path: str | Path,
         lowercase: bool,
-        model_type: ModelType = ModelType.SOFTMAX
+        model_type: ModelType = ModelType.SOFTMAX,
+        length_buckets=LENGTH_BUCKETS,
+        jit_compile: bool = False,
+        saved_model_path: str | Path | None = None,
+        text_tokenizer: str = "spacy",
+        window_stride: int = 128
     ):
         self.checkpoint_path = checkpoint_path
 
@@ -121,21 +172,38 @@ class HugFace_Model():
             do_lower_case=lowercase
             )
         self.tokenizer.add_tokens(["<Chemical>","</Chemical>","<Disease>","</Disease>","<CellLine>","</CellLine>","<Gene>","</Gene>","<Species>","</Species>","<Variant>","</Variant>","<ALL>","</ALL>"])
+        # prepare_data encodes whole sentences and splits them into windows
+        # itself. It is called from several threads, so the shared Rust
+        # tokenizer is configured once here and never changed afterwards.
+        backend = self.tokenizer.backend_tokenizer
+        if backend.truncation is not None:
+            backend.no_truncation()
+        if backend.padding is not None:
+            backend.no_padding()
+
+        self.maxlen = max(length_buckets)
+        self.length_buckets = sorted(length_buckets)
+        self.window_stride = window_stride
+        self.text_tokenizer = create_tokenizer(text_tokenizer)
 
-        self.maxlen = 256
-        self.nlp = stanza.Pipeline(lang='en', processors={'tokenize': 'spacy'}, package='None')
-
-        self.encoder = self.init_encoder()
         self.model_type = model_type
-        self.model = self.init_model(model_type)
+        if saved_model_path is not None:
+            # Inference graph written by export, no Keras model is built
+            self.model = tf.saved_model.load(str(saved_model_path))
+            self.serve = self.model.serve
+            self.serving_functions = {length: self.serve for length in self.length_buckets}
+        else:
+            self.encoder = self.init_encoder()
+            self.model = self.init_model(model_type)
+            self.serve, self.serving_functions = self.init_serving(jit_compile)
 
     def init_encoder(self):
         plm_model = TFAutoModel.from_pretrained(self.checkpoint_path, from_pt=True) # type: ignore
         plm_model.resize_token_embeddings(len(self.tokenizer))
 
-        input_ids      = Input(shape=(self.maxlen,), dtype=tf.int32, name='input_ids')
-        token_type_ids = Input(shape=(self.maxlen,), dtype=tf.int32, name='token_type_ids')
-        attention_mask = Input(shape=(self.maxlen,), dtype=tf.int32, name='attention_mask')
+        input_ids      = Input(shape=(None,), dtype=tf.int32, name='input_ids')
+        token_type_ids = Input(shape=(None,), dtype=tf.int32, name='token_type_ids')
+        attention_mask = Input(shape=(None,), dtype=tf.int32, name='attention_mask')
 
         output = plm_model(
             input_ids,
@@ -148,14 +216,14 @@ class HugFace_Model():
             outputs=output,
             name='hugface_encoder'
             )
-        encoder.summary()
 
         return encoder
 
-    def init_model(self, model_type: ModelType):
-        x1_in = Input(shape=(self.maxlen,),dtype=tf.int32)
-        x2_in = Input(shape=(self.maxlen,),dtype=tf.int32)
-        x3_in = Input(shape=(self.maxlen,),dtype=tf.int32)
+    def init_model(self, model_type: ModelType, training: bool = False):
+        """Build the tagging model; it is only compiled with its optimizer for ``training``."""
+        x1_in = Input(shape=(None,),dtype=tf.int32)
+        x2_in = Input(shape=(None,),dtype=tf.int32)
+        x3_in = Input(shape=(None,),dtype=tf.int32)
         features = self.encoder([x1_in,x2_in,x3_in])
         features = TimeDistributed(Dense(128, activation='relu'), name='dense2')(features)
         features= Dropout(0.1)(features)
@@ -168,6 +236,14 @@ class HugFace_Model():
                     ),
                 name='softmax')(features)
 
+            model = Model(
+                inputs=[x1_in, x2_in, x3_in],
+                outputs=output,
+                name="hugface_softmax"
+                )
+            if not training:
+                return model
+
             lr_schedule = LRSchedule_LINEAR(
                 init_lr=2e-5,
                 init_warmup_lr=1e-7,
@@ -177,11 +253,6 @@ class HugFace_Model():
                 )
             optimizer = Adam(learning_rate=lr_schedule) # type: ignore
 
-            model = Model(
-                inputs=[x1_in, x2_in, x3_in],
-                outputs=output,
-                name="hugface_softmax"
-                )
             model.compile(
                 optimizer=optimizer, # type: ignore
                 loss='sparse_categorical_crossentropy',
@@ -197,6 +268,14 @@ class HugFace_Model():
                 )
             output = crf(features)
 
+            model = Model(
+                inputs=[x1_in, x2_in, x3_in],
+                outputs=output,
+                name="hugface_crf"
+                )
+            if not training:
+                return model
+
             lr_schedule=LRSchedule_LINEAR(
             init_lr=2e-5,
             init_warmup_lr=0.0,
@@ -205,11 +284,6 @@ class HugFace_Model():
             decay_steps=400)
             optimizer = Adam(learning_rate = lr_schedule) # type: ignore
 
-            model = Model(
-                inputs=[x1_in, x2_in, x3_in],
-                outputs=output,
-                name="hugface_crf"
-                )
             model.compile(
                 optimizer=optimizer, # type: ignore
                 loss=crf.get_loss,
@@ -219,61 +293,215 @@ class HugFace_Model():
 
             return model
 
-    def load_model(self, model_file):
-        self.model.load_weights(model_file)
-        self.model.summary()
-
-    def tokenize(self, text: str):
-        text = text.strip()
-        text = re.sub(r"([\=\/\(\)\<\>\+\-\_])", " \\1 ", text)
-        text = re.sub(r"[ ]+", " ", text)
-
-        doc_stanza = self.nlp(text)
-        return [
-            [extract_lemma(word) for word in sentence.words]
-            for sentence in doc_stanza.sentences
-        ]
-
-    def prepare_data(self, tokenized, word_max_len: int = 256):
-        def tokenizer_func(sentence):
-            tokenizer_res = self.tokenizer(
-                sentence,
-                max_length=word_max_len,
-                truncation=True,
-                is_split_into_words=True
+    def init_serving(self, jit_compile: bool = False):
+        """
+        Wrap inference in a ``tf.function`` traced once per length bucket.
+
+        Calling the concrete functions skips the data adapter and iterator
+        ``model.predict`` builds on every call. With ``jit_compile`` the graph
+        is compiled with XLA.
+        """
+        @tf.function(experimental_compile=jit_compile)
+        def serve(input_ids, token_type_ids, attention_mask):
+            return self.model([input_ids, token_type_ids, attention_mask], training=False)
+
+        serving_functions = {
+            length: serve.get_concrete_function(
+                *[tf.TensorSpec([None, length], tf.int32)] * 3
             )
+            for length in self.length_buckets
+        }
+        return serve, serving_functions
 
-            word_indexes = tokenizer_res.word_ids(batch_index=0)
+    def warmup(self, batch_size: int = 1):
+        """Run every serving function once, so the first requests do not pay for it."""
+        for length, function in self.serving_functions.items():
+            inputs = tf.zeros([batch_size, length], dtype=tf.int32)
+            function(inputs, inputs, tf.ones([batch_size, length], dtype=tf.int32))
 
-            # IDK what is this part, just copied
-            first_index, ori_i = -1, 0
-            new_token_map = []
-            for i, word_index in enumerate(word_indexes):
-                if word_index is not None:
-                    first_index = word_index
+    def load_model(self, model_file):
+        self.model.load_weights(model_file)
 
-                    if first_index == ori_i:
-                        new_token_map.append(WordMap(sentence[word_index], i))
-                        ori_i += 1
+    def export(self, export_dir: str | Path):
+        """
+        Write the serving functions as an inference-only SavedModel.
+
+        Only the model weights and the graphs traced for each length bucket
+        are saved (no optimizer, dropout disabled), along with the tokenizer,
+        so the service can start from ``saved_model_path`` without building
+        the Keras model.
+        """
+        module = tf.Module()
+        module.model = self.model
+        module.serve = self.serve
+        tf.saved_model.save(module, str(export_dir))
+        self.tokenizer.save_pretrained(os.path.join(export_dir, "tokenizer"))
 
-            return (
-                tokenizer_res["input_ids"],
-                tokenizer_res["token_type_ids"],
-                tokenizer_res["attention_mask"],
-                new_token_map
-                )
+    def tokenize(self, text: str):
+        return self.text_tokenizer.tokenize(text)
 
-        input_ids,\
-        token_type_ids,\
-        attention_mask,\
-        word_index     = list(zip(*(tokenizer_func(sentence) for sentence in tokenized)))
+    def tokenize_many(self, texts):
+        return self.text_tokenizer.tokenize_many(texts)
 
-        input_ids      = pad_sequences(input_ids, word_max_len, value=0, padding='post',truncating='post')
-        token_type_ids = pad_sequences(token_type_ids, word_max_len, value=0, padding='post',truncating='post')
-        attention_mask = pad_sequences(attention_mask, word_max_len, value=0, padding='post',truncating='post')
+    def prepare_data(self, tokenized, word_max_len: int = 256):
+        """
+        Encode tokenized sentences with a single call to the fast tokenizer.
+
+        Sentences longer than ``word_max_len`` subword tokens are split into
+        overlapping windows starting ``window_stride`` tokens apart, each
+        keeping the special tokens around the sentence. Returns the input ids,
+        token type ids and attention masks of all windows as int32 arrays
+        padded to the bucket of the longest window, the number of tokens of
+        each window, and the word starts of all sentences.
+        """
+        # The Rust tokenizer is called directly: its encodings are copied into
+        # the arrays without being converted to Python lists first
+        encodings = self.tokenizer.backend_tokenizer.encode_batch(list(tokenized), is_pretokenized=True)
+
+        lengths = np.fromiter((len(encoding) for encoding in encodings), dtype=np.int64, count=len(encodings))
+        sentence_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+        # Windows hold up to `capacity` tokens of the sentence between its
+        # first and last special token; the last window ends with the sentence
+        capacity = word_max_len - 2
+        stride = min(self.window_stride, capacity)
+        content = lengths - 2
+        overflow = np.maximum(content - capacity, 0)
+        counts = 1 + (overflow + stride - 1) // stride
+        window_offsets = np.concatenate([[0], np.cumsum(counts)])
+        window_sentences = np.repeat(np.arange(len(encodings)), counts)
+        window_starts = np.minimum(
+            (np.arange(window_offsets[-1]) - window_offsets[window_sentences]) * stride,
+            overflow[window_sentences]
+        )
+        window_lengths = np.minimum(content[window_sentences] - window_starts, capacity) + 2
+
+        # Token of the concatenated encodings copied to each cell of the arrays
+        width = int(self.bucket_lengths(window_lengths.max(initial=0), word_max_len))
+        mask = np.arange(width) < window_lengths[:, None]
+        source = (sentence_starts[window_sentences] + window_starts)[:, None] + np.arange(width)
+        source[:, 0] = sentence_starts[window_sentences]
+        source[np.arange(len(source)), window_lengths - 1] = (sentence_starts + lengths - 1)[window_sentences]
+        source = source[mask]
+
+        input_data = []
+        for field in ("ids", "type_ids", "attention_mask"):
+            values = np.zeros((len(window_sentences), width), dtype=np.int32)
+            values[mask] = np.fromiter(
+                itertools.chain.from_iterable(getattr(encoding, field) for encoding in encodings),
+                dtype=np.int32,
+                count=int(lengths.sum())
+            )[source]
+            input_data.append(values)
+
+        # Special tokens have no word id and become NaN
+        word_ids = np.array(
+            list(itertools.chain.from_iterable(encoding.word_ids for encoding in encodings)),
+            dtype=np.float64
+        )
+        sentences = np.repeat(np.arange(len(encodings)), lengths)
+        positions = np.arange(len(word_ids)) - sentence_starts[sentences]
+
+        # A word starts at its first subword token: a token with a word id that
+        # differs from the previous token of the same sentence
+        starts = ~np.isnan(word_ids)
+        starts[1:] &= (word_ids[1:] != word_ids[:-1]) | (sentences[1:] != sentences[:-1])
+        sentences, positions = sentences[starts], positions[starts]
+
+        # Each word is read from the window whose centre is nearest to it, where
+        # the model saw the most context on both sides
+        candidates = window_offsets[sentences][:, None] + np.arange(counts.max(initial=1))
+        valid = candidates < window_offsets[sentences + 1][:, None]
+        candidates = np.where(valid, candidates, window_offsets[sentences][:, None])
+        centres = window_starts[candidates] + (window_lengths[candidates] - 1) / 2
+        distances = np.where(valid, np.abs(positions[:, None] - centres), np.inf)
+        rows = candidates[np.arange(len(candidates)), distances.argmin(axis=1)]
+
+        word_starts = WordStarts(
+            sentences,
+            word_ids[starts].astype(np.int64),
+            rows,
+            positions - window_starts[rows],
+            np.concatenate([[0], np.cumsum(np.bincount(sentences, minlength=len(encodings)))])
+        )
+        return tuple(input_data), window_lengths, word_starts
+
+    def bucket_lengths(self, lengths, word_max_len: int = 256):
+        """Smallest bucket each sequence of ``lengths`` tokens fits in."""
+        buckets = np.array([*self.length_buckets, word_max_len])
+        return buckets[np.searchsorted(self.length_buckets, lengths)]
+
+    def predict_batch(self, input_data, batch_size: int = 64) -> np.ndarray:
+        """Run padded inputs of a single length through the serving function of that length."""
+        length = input_data[0].shape[1]
+        function = self.serving_functions.get(length, self.serve)
+        return np.concatenate([
+            function(*[tf.constant(inputs[start:start + batch_size]) for inputs in input_data]).numpy()
+            for start in range(0, len(input_data[0]), batch_size)
+        ])
+
+    def predict(
+        self,
+        tokenized,
+        word_max_len: int = 256,
+        batch_size: int = 64,
+        ommit_undefined: bool = True
+        ):
+        """Label tokenized sentences, returning a :class:`LabeledSentence` for each sentence."""
+        if not tokenized:
+            return []
+
+        input_data, lengths, word_starts = self.prepare_data(tokenized, word_max_len)
+        bucket_lengths = self.bucket_lengths(lengths, word_max_len)
+
+        # Windows are predicted bucket by bucket, cut to the bucket length,
+        # and the label of every token is kept
+        token_labels = np.zeros(input_data[0].shape, dtype=np.int64)
+        for length in np.unique(bucket_lengths):
+            indexes = np.flatnonzero(bucket_lengths == length)
+            batch = [inputs[indexes, :length] for inputs in input_data]
+            predictions = self.predict_batch(batch, batch_size)
+            if self.model_type == ModelType.SOFTMAX:
+                predictions = predictions.argmax(axis=-1)
+            token_labels[indexes, :length] = predictions
+
+        # Words are labeled by their first subword token
+        labels = token_labels[word_starts.rows, word_starts.positions]
+        words = word_starts.words
+        offsets = word_starts.offsets
+        if ommit_undefined:
+            kept = labels != AioLabel.UNDEFINED.value
+            labels, words = labels[kept], words[kept]
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(word_starts.sentences[kept], minlength=len(tokenized)))])
+
+        output = [
+            LabeledSentence(tokenized[i], words[offsets[i]:offsets[i + 1]], labels[offsets[i]:offsets[i + 1]])
+            for i in range(len(tokenized))
+        ]
+        return output
 
+    def process_texts(
+        self,
+        texts,
+        word_max_len: int = 256,
+        batch_size: int = 64,
+        ommit_undefined: bool = True
+        ):
+        """
+        Label several texts at once.
+
+        The sentences of all texts are predicted together, so batches are
+        filled across texts, and the labels are split back per text.
+        """
+        tokenized = self.tokenize_many(texts)
+        labeled = self.predict(
+            list(itertools.chain.from_iterable(tokenized)),
+            word_max_len,
+            batch_size,
+            ommit_undefined
+        )
 
-        return (input_ids, token_type_ids, attention_mask), word_index
+        return split_by_text(labeled, tokenized)
 
     def process_text(
         self,
@@ -282,58 +510,37 @@ class HugFace_Model():
         batch_size: int = 64,
         ommit_undefined: bool = True
         ):
-        tokenized = self.tokenize(text)
-        input_data, word_index = self.prepare_data(tokenized, word_max_len)
-        processed = self.model.predict(input_data, batch_size=batch_size)
-
-        output = []
-        for i in range(len(word_index)):
-            sentence = []
-            for j in range(len(word_index[i])):
-                if self.model_type == ModelType.SOFTMAX:
-                    condition = processed[i][j][-1] < len(word_index[i])
-                else:
-                    condition = True
-                if condition:
-                    if self.model_type == ModelType.SOFTMAX:
-                        label_id  = np.argmax(processed[i][word_index[i][j].index])
-                    else:
-                        label_id  = processed[i][word_index[i][j].index]
-                    label_tag = AioLabel(label_id)
-                else:
-                    label_tag = AioLabel.UNDEFINED
-                if word_index[i][j] is not None:
-                    if not (ommit_undefined and label_tag == AioLabel.UNDEFINED):
-                        sentence.append((word_index[i][j].token, label_tag))
-            output.append(sentence)
+        return self.process_texts([text], word_max_len, batch_size, ommit_undefined)[0]
 
-        return output
+    def assemble_output(self, output: List[LabeledSentence]) -> Dict[str, List[str]]:
+        """Collect the entities of the labeled sentences of a text, by entity type."""
+        tokens = list(itertools.chain.from_iterable(sentence.labeled_tokens() for sentence in output))
+        data = defaultdict(dict)
+        for first, last, entity in zip(*entity_spans(concatenate_labels(output))):
+            data[ENTITY_NAMES[entity]][" ".join(tokens[first:last + 1])] = None
+
+        return {key: list(value) for key, value in data.items()}
+
+    def assemble_spans(self, text: str, output: List[LabeledSentence]) -> List[dict]:
+        """List the entities of a text with their character offsets in it."""
+        starts, ends = token_offsets(text, list(itertools.chain.from_iterable(sentence.tokens for sentence in output)))
+
+        # Positions of the labeled words among all the tokens of the text
+        sentence_starts = np.cumsum([0] + [len(sentence.tokens) for sentence in output])
+        positions = np.concatenate(
+            [start + sentence.words for start, sentence in zip(sentence_starts, output)] + [np.zeros(0, dtype=np.int64)]
+        )
 
-    def assemble_output(self, output: list):
-        last_label = AioLabel.UNDEFINED
-        last_word = ""
-        data = defaultdict(set)
-
-        for token, label in itertools.chain(*output):
-            if label.label_type == "B":
-                if last_word:
-                    data[last_label.label_name] |= {last_word}
-                last_word = token
-            elif label.label_type == "I":
-                if last_word and last_label.label_name == label.label_name:
-                    last_word += ' ' + token
-                else:
-                    last_word = token
-            else:
-                last_word = ""
-
-            last_label = label
-
-        if last_word:
-            data[last_label.label_name] |= {last_word}
-
-        data = {key: list(value) for key, value in data.items()}
-        return data
+        spans = []
+        for first, last, entity in zip(*entity_spans(concatenate_labels(output))):
+            start, end = int(starts[positions[first]]), int(ends[positions[last]])
+            spans.append({
+                "label": ENTITY_NAMES[entity],
+                "text": text[start:end],
+                "start": start,
+                "end": end
+            })
+        return spans
 
 
 if __name__ == "__main__":
@@ -10,7 +10,9 @@ import yaml
 from fastapi import FastAPI, HTTPException
 import uvicorn
 
-from hugface import HugFace_Model, ModelType
+from batching import MicroBatcher, Overloaded
+from cache import ResultCache, model_version
+from hugface import HugFace_Model, ModelType, LENGTH_BUCKETS
 
 class TextEntry(BaseModel):
     id: str
@@ -20,30 +22,67 @@ class TextEntry(BaseModel):
 class ProcessRequest(BaseModel):
     entries: List[TextEntry]
     model_type: str = Field("aioner", description="Model type to use for processing")
+    return_spans: bool = Field(False, description="Also return the entities with their character offsets")
+
+
+class EntitySpan(BaseModel):
+    label: str
+    text: str
+    start: int
+    end: int
 
 
 class ProcessResult(BaseModel):
     id: str
     result: Dict[str, List[str]]
+    spans: Optional[List[EntitySpan]] = None
 
 
 class ProcessResponse(BaseModel):
     results: List[ProcessResult]
 
-def init_aioner_model():
+def load_config():
     config_path = os.environ.get('CONFIG_FILE')
     if not config_path:
         raise ValueError("CONFIG_FILE environment variable not set")
 
     with open(config_path) as file:
-        config = yaml.safe_load(file)
+        return yaml.safe_load(file)
 
+def build_aioner_model(config):
+    """Build the Keras model from the pretrained checkpoint and the .h5 weights."""
+    aioner = config["models"]["aioner"]
     model = HugFace_Model(
-        checkpoint_path=config["models"]["aioner"]["checkpoint"],
-        lowercase=config["models"]["aioner"]["lowercase"],
-        model_type=ModelType(config["models"]["aioner"]["model_type"])
+        checkpoint_path=aioner["checkpoint"],
+        lowercase=aioner["lowercase"],
+        model_type=ModelType(aioner["model_type"]),
+        length_buckets=aioner.get("length_buckets", LENGTH_BUCKETS),
+        jit_compile=aioner.get("jit_compile", False),
+        text_tokenizer=aioner.get("tokenizer", "spacy"),
+        window_stride=aioner.get("window_stride", 128)
     )
-    model.load_model(config["models"]["aioner"]["path"])
+    model.load_model(aioner["path"])
+    return model
+
+def init_aioner_model(config):
+    aioner = config["models"]["aioner"]
+    saved_model = aioner.get("saved_model")
+    if saved_model and os.path.isdir(saved_model):
+        # Exported with export.py: loaded directly, without rebuilding the graph
+        model = HugFace_Model(
+            checkpoint_path=os.path.join(saved_model, "tokenizer"),
+            lowercase=aioner["lowercase"],
+            model_type=ModelType(aioner["model_type"]),
+            length_buckets=aioner.get("length_buckets", LENGTH_BUCKETS),
+            saved_model_path=saved_model,
+            text_tokenizer=aioner.get("tokenizer", "spacy"),
+            window_stride=aioner.get("window_stride", 128)
+        )
+    else:
+        model = build_aioner_model(config)
+
+    if aioner.get("warmup", True):
+        model.warmup()
     return model
 
 app = FastAPI(
@@ -54,13 +93,61 @@ app = FastAPI(
 )
 
 AIONER_MODEL = None
+BATCHER = None
+RESULT_CACHE = None
 
 @app.on_event("startup")
 async def startup_event():
-    global AIONER_MODEL
-    AIONER_MODEL = init_aioner_model()
+    global AIONER_MODEL, BATCHER, RESULT_CACHE
+    config = load_config()
+    AIONER_MODEL = init_aioner_model(config)
+
+    cache = config.get("cache", {})
+    if cache.get("max_entries", 10000):
+        RESULT_CACHE = ResultCache(
+            model_version(config),
+            max_entries=cache.get("max_entries", 10000),
+            path=cache.get("path") or None,
+            disk_max_entries=cache.get("disk_max_entries", 1000000)
+        )
 
-@app.post("/process", response_model=ProcessResponse)
+    batching = config.get("batching", {})
+    BATCHER = MicroBatcher(
+        AIONER_MODEL,
+        max_batch_size=batching.get("max_batch_size", 64),
+        max_delay=batching.get("max_delay_ms", 10) / 1000,
+        max_concurrency=batching.get("max_concurrency", 1),
+        max_queue_size=batching.get("max_queue_size", 64),
+        retry_after=batching.get("retry_after", 1)
+    )
+    BATCHER.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if BATCHER:
+        await BATCHER.close()
+    if RESULT_CACHE:
+        await RESULT_CACHE.close()
+
+async def label_texts(texts: List[str], model_type: str) -> List[list]:
+    """Label texts, running the model once for each distinct text that is not cached."""
+    unique = list(dict.fromkeys(texts))
+    results = {}
+    if RESULT_CACHE:
+        keys = {text: RESULT_CACHE.key(text, model_type) for text in unique}
+        cached = await RESULT_CACHE.get_many(list(keys.values()))
+        results = {text: cached[key] for text, key in keys.items() if key in cached}
+
+    missing = [text for text in unique if text not in results]
+    if missing:
+        processed = await BATCHER.process(missing)
+        results.update(zip(missing, processed))
+        if RESULT_CACHE:
+            await RESULT_CACHE.put_many({keys[text]: output for text, output in zip(missing, processed)})
+
+    return [results[text] for text in texts]
+
+@app.post("/process", response_model=ProcessResponse, response_model_exclude_none=True)
 async def process_text(request: ProcessRequest):
     """
     Process text with the NLP model
@@ -73,17 +160,38 @@ async def process_text(request: ProcessRequest):
             detail="Model not initialized. Please try again later."
         )
 
-    response = []
-    for entry in request.entries:
-        processed = AIONER_MODEL.process_text(entry.text)
-        print(processed)
-        assembled = AIONER_MODEL.assemble_output(processed)
-        print(assembled)
-        response.append(ProcessResult(id=entry.id, result=assembled))
+    # The sentences of all entries are labeled together, along with those of
+    # concurrent requests, outside of the event loop; identical and cached
+    # texts are not labeled again
+    try:
+        processed = await label_texts([entry.text for entry in request.entries], request.model_type)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many requests are being processed. Please try again later.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    response = [
+        ProcessResult(
+            id=entry.id,
+            result=AIONER_MODEL.assemble_output(output),
+            spans=AIONER_MODEL.assemble_spans(entry.text, output) if request.return_spans else None
+        )
+        for entry, output in zip(request.entries, processed)
+    ]
 
     return ProcessResponse(results=response)
 
 
+@app.get("/cache")
+async def cache_stats():
+    """Get hit/miss counters and size of the result cache"""
+    if not RESULT_CACHE:
+        return {"enabled": False}
+    return {"enabled": True, **await RESULT_CACHE.stats()}
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
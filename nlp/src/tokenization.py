@@ -0,0 +1,123 @@
+from __future__ import annotations
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+
+import numpy as np
+
+# Characters spaced out before tokenization, so they always become tokens
+_SPACED = re.compile(r"([\=\/\(\)\<\>\+\-\_])")
+_SPACES = re.compile(r"[ ]+")
+
+
+def normalize(text: str) -> str:
+    text = text.strip()
+    text = _SPACED.sub(" \\1 ", text)
+    return _SPACES.sub(" ", text)
+
+
+def token_offsets(text: str, tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Character offsets of the tokens of a text in the original text.
+
+    Normalization only changes whitespace, so every token is found in order.
+    A token that is not found gets an empty span where the previous one ended.
+    """
+    starts = np.zeros(len(tokens), dtype=np.int64)
+    ends = np.zeros(len(tokens), dtype=np.int64)
+    position = 0
+    for i, token in enumerate(tokens):
+        start = text.find(token, position)
+        if start >= 0:
+            position = start + len(token)
+        else:
+            start = position
+        starts[i], ends[i] = start, position
+    return starts, ends
+
+
+def extract_lemma(word) -> str:
+    return str(word.lemma) if word.lemma else str(word.text)
+
+
+class TextTokenizer(ABC):
+    """Splits texts into sentences of words."""
+
+    @abstractmethod
+    def tokenize(self, text: str) -> List[List[str]]:
+        pass
+
+    def tokenize_many(self, texts: List[str]) -> List[List[List[str]]]:
+        return [self.tokenize(text) for text in texts]
+
+
+class SpacyTokenizer(TextTokenizer):
+    """
+    Blank spaCy English pipeline: the spaCy tokenizer followed by the sentencizer.
+
+    No model is loaded. Several texts are processed in bulk with ``nlp.pipe``.
+    """
+
+    def __init__(self):
+        import spacy
+
+        self.nlp = spacy.blank("en")
+        self.nlp.add_pipe("sentencizer")
+        # Texts are tokenized from the inference threads, which must not share
+        # the pipeline concurrently
+        self._lock = threading.Lock()
+
+    def tokenize(self, text: str) -> List[List[str]]:
+        with self._lock:
+            return self._words(self.nlp(normalize(text)))
+
+    def tokenize_many(self, texts: List[str]) -> List[List[List[str]]]:
+        with self._lock:
+            return [self._words(document) for document in self.nlp.pipe(normalize(text) for text in texts)]
+
+    @staticmethod
+    def _words(document) -> List[List[str]]:
+        sentences = (
+            [token.text for token in sentence if not token.is_space]
+            for sentence in document.sents
+        )
+        return [words for words in sentences if words]
+
+
+class StanzaTokenizer(TextTokenizer):
+    """Stanza pipeline with the spaCy tokenizer; several texts are processed in bulk."""
+
+    def __init__(self):
+        import stanza
+
+        self._stanza = stanza
+        self.nlp = stanza.Pipeline(lang='en', processors={'tokenize': 'spacy'}, package='None')
+
+    def tokenize(self, text: str) -> List[List[str]]:
+        return self._words(self.nlp(normalize(text)))
+
+    def tokenize_many(self, texts: List[str]) -> List[List[List[str]]]:
+        documents = self.nlp.bulk_process([
+            self._stanza.Document([], text=normalize(text)) for text in texts
+        ])
+        return [self._words(document) for document in documents]
+
+    @staticmethod
+    def _words(document) -> List[List[str]]:
+        return [
+            [extract_lemma(word) for word in sentence.words]
+            for sentence in document.sentences
+        ]
+
+
+TOKENIZERS = {
+    "spacy": SpacyTokenizer,
+    "stanza": StanzaTokenizer,
+}
+
+
+def create_tokenizer(name: str = "spacy") -> TextTokenizer:
+    if name not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer {name!r}, expected one of {', '.join(TOKENIZERS)}")
+    return TOKENIZERS[name]()
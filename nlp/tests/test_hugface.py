@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import itertools
+from collections import defaultdict
+
+import numpy as np
+import pytest
+from transformers import BertTokenizerFast
+
+from hugface import (
+    ENTITY_NAMES,
+    LENGTH_BUCKETS,
+    AioLabel,
+    HugFace_Model,
+    LabeledSentence,
+    concatenate_labels,
+    entity_spans,
+)
+
+# Synthetic WordPiece vocabulary: words are a stem, unique within the test
+# sentences, followed by up to three subword suffixes
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+STEMS = [f"g{i}" for i in range(2000)]
+SUFFIXES = ["", "a", "ab", "cba"]
+SENTENCE_LENGTHS = [1, 2, 15, 60, 130, 300] * 2
+
+
+def reference_spans(labels):
+    """
+    Entities found by a token loop like the one ``assemble_output`` ran before
+    labels were decoded as arrays, as first and last label index and entity name.
+    """
+    spans = []
+    last_label = AioLabel.UNDEFINED
+    first = None
+    for index, label in enumerate(AioLabel(int(label)) for label in labels):
+        if label.label_type == "I" and first is not None and last_label.label_name == label.label_name:
+            pass
+        else:
+            if first is not None:
+                spans.append((first, index - 1, last_label.label_name))
+            first = index if label.label_type in ("B", "I") else None
+        last_label = label
+
+    if first is not None:
+        spans.append((first, len(labels) - 1, last_label.label_name))
+    return spans
+
+
+def reference_output(output):
+    """Entities of a text collected by a token loop like the former ``assemble_output``, as sets."""
+    last_label = AioLabel.UNDEFINED
+    last_word = ""
+    data = defaultdict(set)
+
+    pairs = itertools.chain.from_iterable(
+        zip(sentence.labeled_tokens(), map(AioLabel, sentence.labels.tolist())) for sentence in output
+    )
+    for token, label in pairs:
+        if label.label_type == "I" and last_word and last_label.label_name == label.label_name:
+            last_word += ' ' + token
+        else:
+            if last_word:
+                data[last_label.label_name] |= {last_word}
+            last_word = token if label.label_type in ("B", "I") else ""
+
+        last_label = label
+
+    if last_word:
+        data[last_label.label_name] |= {last_word}
+    return dict(data)
+
+
+def random_output(rng, n_sentences):
+    """Labeled sentences with every label id, where some words are left unlabeled."""
+    output = []
+    for _ in range(n_sentences):
+        n_tokens = int(rng.integers(0, 12))
+        tokens = [f"t{i}" for i in rng.integers(0, 6, n_tokens)]
+        words = np.flatnonzero(rng.random(n_tokens) < 0.9)
+        labels = rng.integers(0, len(AioLabel), len(words))
+        output.append(LabeledSentence(tokens, words, labels))
+    return output
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_entity_spans_match_token_loop(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(500):
+        labels = rng.integers(0, len(AioLabel), int(rng.integers(0, 20)))
+        spans = [
+            (int(first), int(last), ENTITY_NAMES[entity])
+            for first, last, entity in zip(*entity_spans(labels))
+        ]
+        assert spans == reference_spans(labels)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_assemble_output_matches_token_loop(seed):
+    rng = np.random.default_rng(seed)
+    model = HugFace_Model.__new__(HugFace_Model)
+    for _ in range(500):
+        output = random_output(rng, int(rng.integers(0, 5)))
+        entities = model.assemble_output(output)
+
+        assert {name: set(words) for name, words in entities.items()} == reference_output(output)
+        assert all(len(words) == len(set(words)) for words in entities.values())
+
+
+@pytest.mark.parametrize("labels, spans", [
+    (["GENE_B", "GENE_I", "GENE_O"], [(0, 1, "GENE")]),
+    (["GENE_B", "GENE_I", "UNDEFINED", "GENE_I"], [(0, 1, "GENE"), (3, 3, "GENE")]),
+    (["GENE_B", "DISEASE_I", "DISEASE_I", "SPECIES_O"], [(0, 0, "GENE"), (1, 2, "DISEASE")]),
+    (["GENE_B", "GENE_B", "GENE_I"], [(0, 0, "GENE"), (1, 2, "GENE")]),
+    (["GENE_O", "CHEMICAL_I"], [(1, 1, "CHEMICAL")]),
+])
+def test_entity_spans_end_at_any_other_label(labels, spans):
+    first, last, entities = entity_spans(np.array([AioLabel[label].value for label in labels]))
+    assert list(zip(first.tolist(), last.tolist(), [ENTITY_NAMES[entity] for entity in entities])) == spans
+
+
+def test_entity_spans_of_empty_output():
+    first, last, entities = entity_spans(concatenate_labels([]))
+    assert len(first) == len(last) == len(entities) == 0
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    """Model holding only what prepare_data needs: the subword tokenizer and length buckets."""
+    vocab = tmp_path_factory.mktemp("vocab") / "vocab.txt"
+    vocab.write_text("\n".join(SPECIAL_TOKENS + STEMS + ["##a", "##b", "##c"]) + "\n")
+
+    model = HugFace_Model.__new__(HugFace_Model)
+    model.tokenizer = BertTokenizerFast(str(vocab), do_lower_case=False)
+    model.maxlen = max(LENGTH_BUCKETS)
+    model.length_buckets = sorted(LENGTH_BUCKETS)
+    return model
+
+
+@pytest.fixture(scope="module")
+def sentences():
+    rng = np.random.default_rng(0)
+    stems = iter(rng.permutation(STEMS))
+    return [
+        [str(next(stems)) + SUFFIXES[suffix] for suffix in rng.integers(0, len(SUFFIXES), length)]
+        for length in rng.permutation(SENTENCE_LENGTHS)
+    ]
+
+
+@pytest.mark.parametrize("word_max_len, window_stride", [
+    (256, 128),
+    (64, 20),
+    (32, 30),
+    (64, 62),
+    (32, 100),
+])
+def test_windows_cover_every_word(model, sentences, word_max_len, window_stride):
+    model.window_stride = window_stride
+    (ids, type_ids, mask), lengths, word_starts = model.prepare_data(sentences, word_max_len)
+
+    encodings = [
+        model.tokenizer.backend_tokenizer.encode(sentence, is_pretokenized=True)
+        for sentence in sentences
+    ]
+    # Sentence and encoding index of every stem token
+    stems = {
+        token: (i, index)
+        for i, encoding in enumerate(encodings)
+        for index, (token, name) in enumerate(zip(encoding.ids, encoding.tokens))
+        if name.startswith("g")
+    }
+
+    assert lengths.max() <= word_max_len
+    assert ids.shape[1] == model.bucket_lengths(lengths.max(), word_max_len)
+
+    # Every window is a contiguous part of one sentence between [CLS] and [SEP],
+    # placed in the sentence by its first stem token
+    windows = []
+    for row, length in enumerate(lengths):
+        assert ids[row, 0] == model.tokenizer.cls_token_id
+        assert ids[row, length - 1] == model.tokenizer.sep_token_id
+        assert not ids[row, length:].any()
+        assert (mask[row] == (np.arange(ids.shape[1]) < length)).all()
+        assert not type_ids[row].any()
+
+        index = next(index for index in range(1, length - 1) if ids[row, index] in stems)
+        sentence, position = stems[ids[row, index]]
+        start = position - index
+        assert ids[row, 1:length - 1].tolist() == encodings[sentence].ids[start + 1:start + length - 1]
+        windows.append((sentence, start, int(length)))
+    assert [sentence for sentence, _, _ in windows] == sorted(sentence for sentence, _, _ in windows)
+
+    for i, encoding in enumerate(encodings):
+        covered = np.zeros(len(encoding), dtype=bool)
+        for _, start, length in (window for window in windows if window[0] == i):
+            covered[start + 1:start + length - 1] = True
+        assert covered[1:-1].all()
+
+    # Every word is read from its first subword token, in the window it is
+    # nearest to the centre of
+    assert word_starts.offsets.tolist() == np.cumsum([0] + [len(sentence) for sentence in sentences]).tolist()
+    for i, sentence in enumerate(sentences):
+        first_tokens = {}
+        for index, word in enumerate(encodings[i].word_ids):
+            if word is not None:
+                first_tokens.setdefault(word, index)
+        centres = [
+            (start, length, start + (length - 1) / 2)
+            for sentence_index, start, length in windows if sentence_index == i
+        ]
+
+        begin, end = word_starts.offsets[i], word_starts.offsets[i + 1]
+        assert (word_starts.sentences[begin:end] == i).all()
+        assert word_starts.words[begin:end].tolist() == list(range(len(sentence)))
+        for word, row, position in zip(
+            word_starts.words[begin:end], word_starts.rows[begin:end], word_starts.positions[begin:end]
+        ):
+            sentence_index, start, length = windows[row]
+            token = first_tokens[word]
+            assert sentence_index == i
+            assert 1 <= position <= length - 2
+            assert start + position == token
+            assert ids[row, position] == encodings[i].ids[token]
+            assert abs(token - (start + (length - 1) / 2)) == min(
+                abs(token - centre)
+                for window_start, window_length, centre in centres
+                if window_start < token < window_start + window_length - 1
+            )
+
+
+def test_short_sentences_keep_one_window(model, sentences):
+    model.window_stride = 128
+    short = [sentence for sentence in sentences if len(sentence) <= 60]
+    (ids, _, _), lengths, word_starts = model.prepare_data(short)
+
+    encodings = model.tokenizer.backend_tokenizer.encode_batch(short, is_pretokenized=True)
+    assert lengths.tolist() == [len(encoding) for encoding in encodings]
+    for row, encoding in enumerate(encodings):
+        assert ids[row, :len(encoding)].tolist() == encoding.ids
+    assert (word_starts.rows == word_starts.sentences).all()
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from tokenization import create_tokenizer, token_offsets
+
+pytest.importorskip("spacy")
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures", "metadata.txt")
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return create_tokenizer("spacy")
+
+
+def test_spacy_tokenizer_splits_sentences_and_words(tokenizer):
+    assert tokenizer.tokenize("Don't stop now.\tHeLa cells (n=12) were\ntreated!  Then washed.") == [
+        ["Do", "n't", "stop", "now", "."],
+        ["HeLa", "cells", "(", "n", "=", "12", ")", "were", "treated", "!"],
+        ["Then", "washed", "."],
+    ]
+    assert tokenizer.tokenize("   ") == []
+
+
+def test_bulk_tokenization_matches_single_texts(tokenizer):
+    with open(FIXTURE) as file:
+        texts = [line.rstrip("\n") for line in file if line.strip()]
+
+    assert tokenizer.tokenize_many(texts) == [tokenizer.tokenize(text) for text in texts]
+
+
+def test_token_offsets_point_into_original_text(tokenizer):
+    text = "GATA1  knockdown in HeLa-S3 cells."
+    tokens = [word for sentence in tokenizer.tokenize(text) for word in sentence]
+    starts, ends = token_offsets(text, tokens)
+
+    assert [text[start:end] for start, end in zip(starts, ends)] == tokens